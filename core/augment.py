@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from multiprocessing import get_context
+from typing import List, Tuple, Iterator, Final
+import os
+import numpy as np
+import scipy.ndimage as img_filter
+
+from identify_card import Image, Card
+
+# perturbation ranges at strength 1 -- every generated frame draws each parameter uniformly from [-max, max] (or
+# [0, max]), scaled by `strength`. NB: preprocessing thresholds absolute luma, so brightness is the harshest one
+_MAX_SHIFT: Final[float] = 1.5  # px, sub-pixel
+_MAX_ROTATION: Final[float] = 1.5  # degrees
+_MAX_BRIGHTNESS: Final[float] = 10.0  # luma levels
+_MAX_CONTRAST: Final[float] = 0.10  # relative, around mid-gray
+_MAX_NOISE: Final[float] = 3.0  # gaussian sensor noise std-dev, levels
+_MAX_BLUR: Final[float] = 0.7  # gaussian blur sigma, px
+
+_CHUNK: Final[int] = 32  # frames per worker task
+_NOISE_POOL_FRAMES: Final[int] = 4  # size of the pre-drawn standard normal pool, in frames
+
+_noise_pool: Image = np.empty(0, dtype=np.float32)
+
+# (frame name, frame) -- frame names are `{index}_{rank}{suit}`: they keep the label (see `benchmark._card_of`), and
+# sort in generation order, so that a replayed corpus keeps its decks of 52 distinct cards
+Frame = Tuple[str, Image]
+
+_sources: List[Tuple[Card, Image]] = []
+
+
+def load_sources(directory: str) -> List[Tuple[Card, Image]]:
+    names = sorted(name[:-4] for name in os.listdir(directory) if name.endswith(".npy"))
+    return [((name[:-1], name[-1]), np.load(os.path.join(directory, f"{name}.npy"))) for name in names]
+
+
+def _noise(rng: np.random.Generator, size: int) -> Image:
+    # standard normal noise for one frame, sliced at a random offset from a fixed pool -- drawing fresh normals for
+    # every frame costs about as much as all the other perturbations together
+    global _noise_pool
+    if _noise_pool.size < _NOISE_POOL_FRAMES * size:
+        _noise_pool = np.random.default_rng(0).standard_normal(_NOISE_POOL_FRAMES * size, dtype=np.float32)
+    start = rng.integers(0, _noise_pool.size - size + 1)
+    return _noise_pool[start:start + size]
+
+
+def augment_frame(img: Image, rng: np.random.Generator, *, strength: float = 1.0) -> Image:
+    # applies one random draw of every perturbation to a yuv frame, preserving its shape & dtype
+    rows, cols, channels = img.shape
+    shift = strength * rng.uniform(-_MAX_SHIFT, _MAX_SHIFT, 2)
+    theta = np.radians(strength * rng.uniform(-_MAX_ROTATION, _MAX_ROTATION))
+    brightness = strength * rng.uniform(-_MAX_BRIGHTNESS, _MAX_BRIGHTNESS)
+    contrast = 1 + strength * rng.uniform(-_MAX_CONTRAST, _MAX_CONTRAST)
+    noise = strength * rng.uniform(0, _MAX_NOISE)
+    blur = strength * rng.uniform(0, _MAX_BLUR)
+
+    # rotation about the frame center + shift, as a single (bilinear) resampling per channel
+    cos, sin = np.cos(theta), np.sin(theta)
+    matrix = np.array([[cos, -sin], [sin, cos]])
+    center = np.array([(rows - 1) / 2, (cols - 1) / 2])
+    offset = center - matrix @ center + shift
+    out = np.empty(img.shape, dtype=np.float32)
+    for c in range(channels):
+        img_filter.affine_transform(img[:, :, c].astype(np.float32), matrix, offset, output=out[:, :, c], order=1,
+                                    mode='nearest')
+        if blur > 0.05:
+            img_filter.gaussian_filter(out[:, :, c], blur, output=out[:, :, c])
+
+    out[:, :, 0] = (out[:, :, 0] - 128) * contrast + 128 + brightness  # luma only
+    out += noise * _noise(rng, out.size).reshape(out.shape)
+    return np.clip(np.rint(out), 0, 255).astype(np.uint8)
+
+
+def _frame_at(index: int, seed: int, strength: float) -> Frame:
+    # frame `index` of the corpus only depends on (`index`, `seed`), so corpora are reproducible for any #workers
+    (rank, suit), img = _sources[index % len(_sources)]
+    return f"{index:06d}_{rank}{suit}", augment_frame(img, np.random.default_rng([seed, index]), strength=strength)
+
+
+def _init_worker(directory: str) -> None:
+    _sources[:] = load_sources(directory)
+
+
+def _generate_chunk(task: Tuple[int, int, int, float]) -> List[Frame]:
+    start, stop, seed, strength = task
+    return [_frame_at(index, seed, strength) for index in range(start, stop)]
+
+
+def generate(directory: str, count: int, *, seed: int = 0, strength: float = 1.0,
+             workers: int = 0) -> Iterator[Frame]:
+    # streams `count` augmented frames, cycling through the reference frames in `directory` -- with `workers` > 0,
+    # frames are generated on a process pool, with at most 2 chunks per worker in flight
+    if workers <= 0:
+        _init_worker(directory)
+        for index in range(count):
+            yield _frame_at(index, seed, strength)
+        return
+
+    tasks = [(start, min(start + _CHUNK, count), seed, strength) for start in range(0, count, _CHUNK)]
+    with get_context("spawn").Pool(processes=workers, initializer=_init_worker, initargs=(directory,)) as pool:
+        pending = [pool.apply_async(_generate_chunk, (task,)) for task in tasks[:2 * workers]]
+        for task in tasks[2 * workers:] + [None] * min(len(tasks), 2 * workers):
+            frames = pending.pop(0).get()
+            if task is not None:
+                pending.append(pool.apply_async(_generate_chunk, (task,)))
+            yield from frames
+
+
+def write_corpus(directory: str, out_directory: str, count: int, *, seed: int = 0, strength: float = 1.0,
+                 workers: int = 0) -> int:
+    # saves `count` augmented frames as `{out_directory}/{index}_{rank}{suit}.npy` -- returns the number written
+    os.makedirs(out_directory, exist_ok=True)
+    n = 0
+    for name, img in generate(directory, count, seed=seed, strength=strength, workers=workers):
+        np.save(os.path.join(out_directory, f"{name}.npy"), img)
+        n += 1
+    return n
+
+
+if __name__ == '__main__':
+    import sys
+    from time import perf_counter
+
+    if not len(sys.argv) > 3 or 'help' in sys.argv[1]:
+        print("Usage: <script> <arg1=reference frame directory> <arg2=output directory> <arg3=#frames> "
+              "[<arg4=#workers>] [<arg5=seed>] [<arg6=strength>]")
+        print("Suggested usage: <script> ./ground_truth/deck1 ./ground_truth/synthetic 10000 4")
+    else:
+        _workers = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+        _seed = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+        _strength = float(sys.argv[6]) if len(sys.argv) > 6 else 1.0
+        _start = perf_counter()
+        _n = write_corpus(sys.argv[1], sys.argv[2], int(sys.argv[3]), seed=_seed, strength=_strength,
+                          workers=_workers)
+        _elapsed = perf_counter() - _start
+        print(f"Wrote {_n} frames to `{sys.argv[2]}` in {_elapsed:.1f} s ({_n / _elapsed:.0f} frames/s)")
@@ -0,0 +1,434 @@
+from time import perf_counter
+from typing import List, Tuple, Dict, Any, Iterator, Optional
+import contextlib
+import io
+import json
+import os
+import platform
+import tracemalloc
+import numpy as np
+
+import identify_card as cv
+import augment
+from identify_card import Image, Card
+
+
+def _frame_names(directory: str) -> List[str]:
+    return sorted(name[:-4] for name in os.listdir(directory) if name.endswith(".npy"))
+
+
+def _load_frames(directory: str) -> List[Tuple[str, Image]]:
+    return [(name, np.load(os.path.join(directory, f"{name}.npy"))) for name in _frame_names(directory)]
+
+
+def _iter_frames(directory: str) -> Iterator[Tuple[str, Image]]:
+    # streams frames one at a time (memory-mapped) -- for corpora too large to hold in memory
+    for name in _frame_names(directory):
+        yield name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+
+
+def _card_of(name: str) -> Card:
+    # frame names are `{rank}{suit}` with an optional `_<anything>` suffix (i.e. `AS.npy`, `AS_take2.npy`), or
+    # `{index}_{rank}{suit}` for generated corpora (i.e. `000123_AS.npy`, see `augment._frame_at`)
+    parts = name.split("_")
+    stem = parts[-1] if parts[0].isdigit() else parts[0]
+    return stem[:-1], stem[-1]
+
+
+def _populate_ground_truth(frames: List[Tuple[str, Image]], **kwargs) -> None:
+    cards_dict: Dict[Card, List[Image]] = {}
+    for name, img in frames:
+        cards_dict.setdefault(_card_of(name), []).append(img)
+    with contextlib.redirect_stdout(io.StringIO()):  # `populate_ground_truth` always prints separators
+        cv.populate_ground_truth(cards_dict, **kwargs)
+
+
+def check_bounding_boxes(directory: str, *, verbose: bool = False) -> bool:
+    # equivalence + timing of `_get_bounding_boxes` vs the original dict-of-tuples union-find
+    ok = True
+    t_ref, t_new = 0.0, 0.0
+    frames = _load_frames(directory)
+    for name, img in frames:
+        edges, _ = cv._preprocess_image_reference(img)
+
+        start = perf_counter()
+        expected = cv._get_bounding_boxes_reference(edges)
+        t_ref += perf_counter() - start
+
+        start = perf_counter()
+        actual = cv._get_bounding_boxes(edges)
+        t_new += perf_counter() - start
+
+        if actual != expected:
+            ok = False
+            print(f"MISMATCH for {name}: expected {len(expected)} bboxes, got {len(actual)}")
+        elif verbose:
+            print(f"{name}: {len(actual)} bboxes match")
+
+    n = max(len(frames), 1)
+    print(f"bbox extraction over {len(frames)} frames: equivalent = {ok}")
+    print(f"  reference : {1000 * t_ref / n:8.3f} ms/frame")
+    print(f"  labeling  : {1000 * t_new / n:8.3f} ms/frame ({t_ref / max(t_new, 1e-9):.1f}x)")
+    return ok
+
+
+def check_preprocessing(directory: str, *, verbose: bool = False) -> bool:
+    # bit-equivalence + timing of the fused preprocessing vs the original multi-pass pipeline, on this machine -- run
+    # it on the target before enabling the fused path there (`cv.use_fused_preprocessing`)
+    ok = True
+    t_ref, t_new = 0.0, 0.0
+    frames = _load_frames(directory)
+    for name, img in frames:
+        start = perf_counter()
+        expected_edges, expected_bboxes = cv._preprocess_image_reference(img)
+        t_ref += perf_counter() - start
+
+        start = perf_counter()
+        edges, bboxes = cv._preprocess_image_fused(img)
+        t_new += perf_counter() - start
+
+        if edges.dtype != expected_edges.dtype or not np.array_equal(edges, expected_edges) \
+                or bboxes != expected_bboxes:
+            ok = False
+            print(f"MISMATCH for {name}")
+        elif verbose:
+            print(f"{name}: preprocessing output matches")
+
+    n = max(len(frames), 1)
+    print(f"preprocessing over {len(frames)} frames on {platform.machine()}: bit-identical = {ok}")
+    print(f"  reference : {1000 * t_ref / n:8.3f} ms/frame")
+    print(f"  fused     : {1000 * t_new / n:8.3f} ms/frame ({t_ref / max(t_new, 1e-9):.1f}x)")
+    return ok
+
+
+def _check_against_exhaustive(directory: str, label: str, *, copies: int = 1, verbose: bool = False,
+                              **identify_kwargs) -> float:
+    # how often `identify_card(**identify_kwargs)` changes the identified card vs the exhaustive scorer (frames are
+    # scored against ground truth built from the same directory, replicated `copies` times)
+    frames = _load_frames(directory)
+    _populate_ground_truth(frames * copies)
+
+    changed, correct_full, correct_pruned = 0, 0, 0
+    t_full, t_pruned = 0.0, 0.0
+    for name, img in frames:
+        edges, bboxes = cv.preprocess_image(img)
+
+        start = perf_counter()
+        expected, _ = cv.identify_card(edges, bboxes)
+        t_full += perf_counter() - start
+
+        start = perf_counter()
+        actual, _ = cv.identify_card(edges, bboxes, **identify_kwargs)
+        t_pruned += perf_counter() - start
+
+        correct_full += expected == _card_of(name)
+        correct_pruned += actual == _card_of(name)
+        if actual != expected:
+            changed += 1
+            if verbose:
+                print(f"{name}: exhaustive={expected}, {label}={actual}")
+
+    n = max(len(frames), 1)
+    print(f"{label} over {len(frames)} frames: argmax changed {changed} times ({changed / n:.1%}), "
+          f"correct {correct_pruned} vs {correct_full} exhaustive")
+    print(f"  exhaustive : {1000 * t_full / n:8.3f} ms/card")
+    print(f"  {label:<11}: {1000 * t_pruned / n:8.3f} ms/card ({t_full / max(t_pruned, 1e-9):.1f}x)")
+    return changed / n
+
+
+def check_cascade(directory: str, *, top_k: int, copies: int = 1, verbose: bool = False) -> float:
+    # NB: with fewer truth images than `cv._CASCADE_MIN_CANDIDATES` the cascade falls back to exhaustive scoring
+    return _check_against_exhaustive(directory, f"cascade (top_k={top_k}, {copies}x truth)", top_k=top_k,
+                                     copies=copies, verbose=verbose)
+
+
+def check_shortlist(directory: str, *, shortlist: int, verbose: bool = False) -> float:
+    return _check_against_exhaustive(directory, f"shortlist (k={shortlist})", shortlist=shortlist, verbose=verbose)
+
+
+def check_scoring_pool(directory: str, *, workers: Tuple[int, ...] = (1, 2, 4), copies: int = 1) -> None:
+    # per-card latency of the in-process scorer vs `ScoringPool` with each worker count -- `copies` replicates the
+    # ground truth to emulate `num_decks` reference decks
+    from scoring_pool import ScoringPool
+
+    frames = _load_frames(directory)
+    _populate_ground_truth(frames * copies)
+    processed = [(name, cv.preprocess_image(img)) for name, img in frames]
+
+    def _run(scorer) -> List[float]:
+        latencies = []
+        for name, (edges, bboxes) in processed:
+            start = perf_counter()
+            cv.identify_card(edges, bboxes, scorer=scorer)
+            latencies.append(perf_counter() - start)
+        return latencies
+
+    base = _run(None)
+    print(f"scoring over {len(frames)} frames against {len(frames) * copies} truth images (pool is experimental, "
+          f"{os.cpu_count()} cpu(s)):")
+    print(f"  in-process : p50 {1000 * np.median(base):8.3f} ms/card")
+    for n in workers:
+        with ScoringPool(workers=n) as pool:
+            _run(pool)  # warm up the workers
+            latencies = _run(pool)
+        print(f"  {n} worker(s): p50 {1000 * np.median(latencies):8.3f} ms/card "
+              f"({np.median(base) / max(np.median(latencies), 1e-9):.2f}x)")
+
+
+_STAGES: Tuple[str, ...] = ("preprocess", "normalize", "identify", "total")
+# allowed regression vs the baseline before `compare_to_baseline` fails
+DEFAULT_THRESHOLDS: Dict[str, float] = {
+    "latency": 0.10,  # relative increase of any stage's p50/p95
+    "throughput": 0.10,  # relative decrease of cards/second
+    "memory": 0.10,  # relative increase of peak traced memory
+    "accuracy": 0.0,  # absolute decrease of accuracy
+}
+
+
+def _shuffled_decks(frames: Iterator[Tuple[str, Image]], seed: int) -> Iterator[Tuple[str, Image]]:
+    # every 52 frames (one deck) in a seeded random order -- corpora are stored in card order, the same order as the
+    # ground truth, so replaying them as is would let a session's tie-breaks (i.e. all zero scores for a frame without
+    # any bbox) pick the right card for free
+    rng = np.random.default_rng(seed)
+    deck: List[Tuple[str, Image]] = []
+    for frame in frames:
+        deck.append(frame)
+        if len(deck) == 52:
+            yield from (deck[i] for i in rng.permutation(len(deck)))
+            deck = []
+    yield from (deck[i] for i in rng.permutation(len(deck)))
+
+
+def _replay(frames: Iterator[Tuple[str, Image]], *, roi: bool, session: bool, narrow: bool, fallback: Optional[float],
+            identify_kwargs: Dict[str, Any]) -> Tuple[Dict[str, List[float]], int, int, int]:
+    # runs every frame through the pipeline -- returns (per-stage latencies in seconds, #frames, #correct, #correct
+    # after each deck's post-deck assignment (same as #correct without sessions))
+    latencies: Dict[str, List[float]] = {stage: [] for stage in _STAGES}
+    n, correct, assigned = 0, 0, 0
+    deck: Optional[cv.IdentificationSession] = None
+    deck_cards: List[Card] = []
+
+    def _end_deck() -> int:
+        return sum(card == expected for card, expected in zip(deck.assign(), deck_cards)) if deck is not None else 0
+
+    for name, img in frames:
+        if session and n % 52 == 0:  # every 52 frames is treated as one deck
+            assigned += _end_deck()
+            deck = cv.IdentificationSession(narrow=narrow, fallback_confidence=fallback, **identify_kwargs)
+            deck_cards = []
+
+        t0 = perf_counter()
+        edges, bboxes = cv.preprocess_image(img, roi=roi)
+        t1 = perf_counter()
+        cv._normalize_bboxes(bboxes)
+        t2 = perf_counter()
+        if deck is not None:
+            card, _ = deck.identify(edges, bboxes)
+        else:
+            card, _ = cv.identify_card(edges, bboxes, **identify_kwargs)
+        t3 = perf_counter()
+
+        latencies["preprocess"].append(t1 - t0)
+        latencies["normalize"].append(t2 - t1)
+        latencies["identify"].append(t3 - t2)  # includes its own bbox normalization
+        latencies["total"].append(t3 - t0)
+        n += 1
+        correct += card == _card_of(name)
+        if deck is None:
+            assigned += card == _card_of(name)
+        else:
+            deck_cards.append(_card_of(name))
+    return latencies, n, correct, assigned + _end_deck()
+
+
+# noinspection PyProtectedMember
+def _truth_footprint() -> Dict[str, float]:
+    # resident size (MB) of the populated ground truth, per kind of data -- arrays sharing a buffer (i.e. per image
+    # views into the bank) are counted once
+    def _root(array: Image) -> Image:
+        while isinstance(array.base, np.ndarray):
+            array = array.base
+        return array
+
+    _, img_data_list = cv._GROUND_TRUTH_IMAGES
+    bank = cv._GROUND_TRUTH_BANK
+    kinds: Dict[str, List[Image]] = {
+        "edges": [edges for (edges, _), _, _, _ in img_data_list],
+        "records": [records for _, records, _, _ in img_data_list] + [bank.records],
+        "patches": [patches for _, _, _, patches in img_data_list] + [bank.patches],
+        "coarse_patches": [bank.coarse_patches],
+    }
+    seen = set()
+    footprint = {}
+    for kind, arrays in kinds.items():
+        roots = [root for root in map(_root, arrays) if id(root) not in seen]
+        seen.update(id(root) for root in roots)
+        footprint[kind] = sum({id(root): root.nbytes for root in roots}.values()) / 2 ** 20
+    footprint["total"] = sum(footprint.values())
+    return footprint
+
+
+def run_suite(directory: str, *, truth_directory: str = "./ground_truth/deck1", roi: bool = False,
+              session: bool = False, narrow: bool = True, fallback: Optional[float] = None,
+              prototypes: Optional[int] = None,
+              synthetic: int = 0, seed: int = 0, strength: float = 1.0, workers: int = 0,
+              **identify_kwargs) -> Dict[str, Any]:
+    # replays a directory of recorded yuv `.npy` frames (named by card, see `_card_of`) through the full
+    # identification pipeline against ground truth built from `truth_directory`. With `synthetic` > 0, `directory`
+    # instead holds reference frames, from which `synthetic` augmented frames are streamed (see `augment.generate`)
+    _populate_ground_truth(_load_frames(truth_directory), roi=roi, prototypes=prototypes)
+    truth_footprint = _truth_footprint()
+
+    def _frames() -> Iterator[Tuple[str, Image]]:
+        if synthetic > 0:
+            frames = augment.generate(directory, synthetic, seed=seed, strength=strength, workers=workers)
+        else:
+            frames = _iter_frames(directory)
+        return _shuffled_decks(frames, seed) if session else frames
+
+    latencies, n, correct, assigned = _replay(_frames(), roi=roi, session=session, narrow=narrow, fallback=fallback,
+                                              identify_kwargs=identify_kwargs)
+
+    # separate pass for memory, so that tracing overhead does not skew the latencies
+    tracemalloc.start()
+    _replay(_frames(), roi=roi, session=session, narrow=narrow, fallback=fallback, identify_kwargs=identify_kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    def _summary(values: List[float]) -> Dict[str, float]:
+        ms = 1000 * np.array(values or [0.0])
+        return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+                "max_ms": float(ms.max())}
+
+    return {
+        "corpus": os.path.abspath(directory),
+        "truth": os.path.abspath(truth_directory),
+        "config": {"roi": roi, "session": session, "narrow": narrow, "fallback": fallback, "prototypes": prototypes,
+                   "synthetic": synthetic, "seed": seed, "strength": strength,
+                   "fused": cv._FUSED_PREPROCESSING, **identify_kwargs},
+        "frames": n,
+        "stages": {stage: _summary(latencies[stage]) for stage in _STAGES},
+        "cards_per_second": n / max(sum(latencies["total"]), 1e-9),
+        "peak_memory_mb": peak / 2 ** 20,
+        "truth_memory_mb": truth_footprint,
+        "accuracy": correct / max(n, 1),
+        "assigned_accuracy": assigned / max(n, 1),
+    }
+
+
+def compare_to_baseline(result: Dict[str, Any], baseline: Dict[str, Any],
+                        thresholds: Optional[Dict[str, float]] = None) -> List[str]:
+    # returns a description of every regression beyond `thresholds` (empty if none)
+    thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    regressions = []
+    if result["config"] != baseline["config"] or result["frames"] != baseline["frames"]:
+        regressions.append(f"incomparable runs: config/frames {result['config']}/{result['frames']} vs "
+                           f"{baseline['config']}/{baseline['frames']}")
+    for stage in _STAGES:
+        for stat in ("p50_ms", "p95_ms"):
+            new, old = result["stages"][stage][stat], baseline["stages"][stage][stat]
+            if new > old * (1 + thresholds["latency"]):
+                regressions.append(f"{stage} {stat}: {new:.3f} vs {old:.3f}")
+    if result["cards_per_second"] < baseline["cards_per_second"] * (1 - thresholds["throughput"]):
+        regressions.append(f"cards/s: {result['cards_per_second']:.1f} vs {baseline['cards_per_second']:.1f}")
+    if result["peak_memory_mb"] > baseline["peak_memory_mb"] * (1 + thresholds["memory"]):
+        regressions.append(f"peak memory: {result['peak_memory_mb']:.2f} MB vs {baseline['peak_memory_mb']:.2f} MB")
+    for key in ("accuracy", "assigned_accuracy"):
+        if key in baseline and result[key] < baseline[key] - thresholds["accuracy"]:
+            regressions.append(f"{key}: {result[key]:.3%} vs {baseline[key]:.3%}")
+    return regressions
+
+
+def _print_suite(result: Dict[str, Any]) -> None:
+    print(f"suite over {result['frames']} frames from {result['corpus']} ({result['config']})")
+    for stage in _STAGES:
+        stats = result["stages"][stage]
+        print(f"  {stage:<10}: p50 {stats['p50_ms']:8.3f} ms | p95 {stats['p95_ms']:8.3f} ms | "
+              f"max {stats['max_ms']:8.3f} ms")
+    print(f"  {result['cards_per_second']:.1f} cards/s | peak memory {result['peak_memory_mb']:.2f} MB | "
+          f"accuracy {result['accuracy']:.1%} "
+          f"(after post-deck assignment {result['assigned_accuracy']:.1%})")
+    if "truth_memory_mb" in result:
+        print("  ground truth " + " | ".join(f"{kind} {mb:.2f} MB" for kind, mb in result["truth_memory_mb"].items()))
+
+
+def _suite_main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="benchmark.py suite", description="Offline identification benchmark")
+    parser.add_argument("frames", help="directory of recorded yuv `.npy` frames named `{rank}{suit}[_*].npy`")
+    parser.add_argument("--truth", default="./ground_truth/deck1", help="ground truth deck directory")
+    parser.add_argument("--out", help="write the JSON result to this file")
+    parser.add_argument("--baseline", help="JSON result to compare against (exit code 1 on regression)")
+    parser.add_argument("--save-baseline", action="store_true", help="write the result to --baseline instead")
+    parser.add_argument("--roi", action="store_true", help="corner index ROI (see `core.py -r`)")
+    parser.add_argument("--fused", action="store_true", help="fused preprocessing (see `core.py -f`)")
+    parser.add_argument("--session", action="store_true", help="identify every 52 frames as one deck session")
+    parser.add_argument("--no-narrowing", action="store_false", dest="narrow",
+                        help="sessions score every card, not only the deck's remaining ones (as `core.py` does)")
+    parser.add_argument("--fallback", type=float, help="session fallback confidence (see IdentificationSession)")
+    parser.add_argument("--top-k", type=int)
+    parser.add_argument("--shortlist", type=int)
+    parser.add_argument("--prototypes", type=int)
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="stream this many augmented frames generated from the reference frames in `frames`")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the augmented frames & of the session deck order")
+    parser.add_argument("--strength", type=float, default=1.0, help="scale of the augmentation perturbations")
+    parser.add_argument("-j", "--workers", type=int, default=0, help="processes generating augmented frames")
+    for key, value in DEFAULT_THRESHOLDS.items():
+        parser.add_argument(f"--max-{key}-regression", type=float, default=value, dest=f"threshold_{key}")
+    args = parser.parse_args(argv)
+
+    cv.use_fused_preprocessing(args.fused)
+    identify_kwargs = {key: value for key, value in (("top_k", args.top_k), ("shortlist", args.shortlist))
+                       if value is not None}
+    result = run_suite(args.frames, truth_directory=args.truth, roi=args.roi, session=args.session,
+                       narrow=args.narrow, fallback=args.fallback, prototypes=args.prototypes,
+                       synthetic=args.synthetic, seed=args.seed, strength=args.strength, workers=args.workers,
+                       **identify_kwargs)
+    _print_suite(result)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved baseline to `{args.baseline}`")
+    elif args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        thresholds = {key: getattr(args, f"threshold_{key}") for key in DEFAULT_THRESHOLDS}
+        regressions = compare_to_baseline(result, baseline, thresholds)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        print(f"Baseline comparison: {'FAILED' if regressions else 'passed'}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'suite':
+        sys.exit(_suite_main(sys.argv[2:]))
+    elif len(sys.argv) > 1 and 'help' in sys.argv[1]:
+        print("Usage: <script> <arg1=directory of frames> [<arg2=cascade top_k>] [<arg3=shortlist size>] [-v] [-j]")
+        print("Suggested usage: <script> ./ground_truth/deck1 8 16")
+        print("  -j additionally benchmarks the multi-process scoring pool with 1/2/4 workers")
+        print("Usage: <script> suite --help")
+        print("  - offline benchmark suite with JSON results & baseline comparison")
+    else:
+        _args = [arg for arg in sys.argv[1:] if arg not in ('-v', '-j')]
+        _dir = _args[0] if len(_args) > 0 else "./ground_truth/deck1"
+        _top_k = int(_args[1]) if len(_args) > 1 else 8
+        _shortlist = int(_args[2]) if len(_args) > 2 else 16
+        _ok = check_bounding_boxes(_dir, verbose='-v' in sys.argv)
+        _ok = check_preprocessing(_dir, verbose='-v' in sys.argv) and _ok
+        check_cascade(_dir, top_k=_top_k, verbose='-v' in sys.argv)
+        check_cascade(_dir, top_k=_top_k, copies=8, verbose='-v' in sys.argv)
+        check_shortlist(_dir, shortlist=_shortlist, verbose='-v' in sys.argv)
+        if '-j' in sys.argv:
+            check_scoring_pool(_dir)
+            check_scoring_pool(_dir, copies=8)
+        sys.exit(0 if _ok else 1)
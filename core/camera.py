@@ -1,4 +1,5 @@
-from time import sleep
+from threading import Condition
+from time import sleep, perf_counter
 from typing import Callable, Tuple, Final
 
 from picamera import PiCamera
@@ -8,24 +9,125 @@ import cv2
 from identify_card import Image
 
 _CAMERA_RESOLUTION: Final[Tuple[int, int]] = 1024, 1008
+# NB: the frame is indexed [row, col], so the crop is rows x1:x2 & cols y1:y2 (i.e. x/y here are swapped w.r.t. the
+# camera resolution) -- every ground truth frame was captured with exactly this crop, so it must not change
 _CROP_BOUNDS: Final[Tuple[int, int, int, int]] = 481, 257, 716, 636  # x1, y1, x2, y2
+_CROP_SHAPE: Final[Tuple[int, int]] = 235, 379  # rows, cols of the ground truth frames
+# continuous capture mode
+_FRAMERATE: Final[int] = 30
+_RING_SIZE: Final[int] = 4  # a returned frame stays valid for (_RING_SIZE - 1) frame periods
+_FRAME_TIMEOUT: Final[float] = 1.0  # seconds
 
 
-def init_camera() -> Callable[[], Image]:
+class _FrameRing:
+    # file-like output for `PiCamera.start_recording` -- keeps the most recent raw frames in pre-allocated slots, along
+    # with the (monotonic) time each frame finished arriving. Writes come from picamera's encoder thread
+    frames: Image  # (size, *frame shape)
+    times: Image  # (size,) float
+    count: int  # number of complete frames written so far
+
+    def __init__(self, shape: Tuple[int, ...], size: int):
+        self.frames = np.empty((size, *shape), dtype=np.uint8)
+        self.times = np.full(size, -np.inf)
+        self.count = 0
+        self._offset = 0  # bytes of the in-progress frame written so far
+        self._cond = Condition()
+
+    def write(self, buf) -> int:
+        # raw frames normally arrive in a single write, but may be split over several
+        data = np.frombuffer(buf, dtype=np.uint8)
+        written = 0
+        while written < len(data):
+            slot = self.frames[self.count % len(self.frames)].reshape(-1)
+            n = min(len(data) - written, len(slot) - self._offset)
+            slot[self._offset:self._offset + n] = data[written:written + n]
+            self._offset += n
+            written += n
+            if self._offset == len(slot):
+                self._offset = 0
+                with self._cond:
+                    self.times[self.count % len(self.frames)] = perf_counter()
+                    self.count += 1
+                    self._cond.notify_all()
+        return len(buf)
+
+    def flush(self) -> None:
+        pass
+
+    def latest_after(self, t: float, frame_period: float, timeout: float) -> Image:
+        # view of the newest frame whose exposure started after `t` (i.e. arrived at least one period after `t`)
+        def _ready() -> bool:
+            return self.count > 0 and self.times[(self.count - 1) % len(self.frames)] - frame_period >= t
+
+        with self._cond:
+            if not self._cond.wait_for(_ready, timeout):
+                raise TimeoutError(f"No camera frame within {timeout} s")
+            return self.frames[(self.count - 1) % len(self.frames)]
+
+
+def _validate_crop() -> None:
+    cols, rows = _CAMERA_RESOLUTION
+    x1, y1, x2, y2 = _CROP_BOUNDS
+    assert 0 <= x1 < x2 <= rows and 0 <= y1 < y2 <= cols, f"Crop {_CROP_BOUNDS} exceeds the {rows}x{cols} frame"
+    assert (x2 - x1, y2 - y1) == _CROP_SHAPE, f"Crop {_CROP_BOUNDS} does not match the ground truth {_CROP_SHAPE}"
+
+
+def _crop_rgb(frame: Image) -> Image:
+    # converts only the crop -- the conversion is per-pixel, so this is bit-identical to converting the whole frame
+    # (what the ground truth frames were captured with) and cropping afterwards
+    x1, y1, x2, y2 = _CROP_BOUNDS
+    # noinspection PyUnresolvedReferences
+    return cv2.cvtColor(np.ascontiguousarray(frame[x1:x2, y1:y2]), cv2.COLOR_RGB2YUV)
+
+
+def _i420_cropper() -> Tuple[int, Callable[[Image], Image]]:
+    # (raw frame size, cropper) for the camera's native (I420, planar & 2x2 chroma subsampled) yuv output -- only the
+    # crop of the Y & V planes is read, and V is upsampled (nearest) to full resolution. U is unused by the card
+    # recognition, so it is left at neutral gray. The returned crop is only valid until the next call
+    cols, rows = _CAMERA_RESOLUTION  # already multiples of 32 x 16, so the planes are unpadded
+    x1, y1, x2, y2 = _CROP_BOUNDS
+    v_start = rows * cols + (rows // 2) * (cols // 2)
+    v_rows, v_cols = np.arange(x1, x2) // 2, np.arange(y1, y2) // 2
+    out = np.full((*_CROP_SHAPE, 3), 128, dtype=np.uint8)
+
+    def _crop(buf: Image) -> Image:
+        y_plane = buf[:rows * cols].reshape(rows, cols)
+        v_plane = buf[v_start:v_start + (rows // 2) * (cols // 2)].reshape(rows // 2, cols // 2)
+        out[:, :, 0] = y_plane[x1:x2, y1:y2]
+        out[:, :, 2] = v_plane[v_rows[:, np.newaxis], v_cols]
+        return out
+
+    return rows * cols * 3 // 2, _crop
+
+
+def init_camera(*, continuous: bool = False, native_yuv: bool = False) -> Callable[[], Image]:
+    # `continuous` streams from the video port into a ring buffer instead of a still capture per request -- this
+    # avoids the still port's mode switch, and each request only waits for the next frame to arrive
+    # `native_yuv` reads the camera's own yuv output instead of converting from rgb -- its chroma is subsampled &
+    # scaled differently, so ground truth must be (re-)captured in the same mode (see `__main__`)
+    _validate_crop()
     camera = PiCamera()
     sleep(2)  # give camera time to boot
 
     x, y = camera.resolution = _CAMERA_RESOLUTION
-    x1, y1, x2, y2 = _CROP_BOUNDS
+    frame_size, crop_i420 = _i420_cropper()
+    crop, fmt, shape = (crop_i420, 'yuv', (frame_size,)) if native_yuv else (_crop_rgb, 'rgb', (y, x, 3))
+
+    if continuous:
+        camera.framerate = _FRAMERATE
+        ring = _FrameRing(shape, _RING_SIZE)
+        camera.start_recording(ring, format=fmt)
+
+        def _capture_frame() -> Image:
+            return crop(ring.latest_after(perf_counter(), 1 / _FRAMERATE, _FRAME_TIMEOUT))
+
+        return _capture_frame
 
-    output = np.empty((y, x, 3), dtype=np.uint8)
+    output = np.empty(shape, dtype=np.uint8)
 
     def _capture_image() -> Image:
-        nonlocal output
-        camera.capture(output, 'rgb')
-        # noinspection PyUnresolvedReferences
-        output = cv2.cvtColor(output, cv2.COLOR_RGB2YUV)
-        return output[x1:x2, y1:y2, :]
+        camera.capture(output, fmt)
+        return crop(output)
 
     return _capture_image
 
@@ -34,12 +136,14 @@ if __name__ == '__main__':
     import sys
 
     if not len(sys.argv) > 1 or 'help' in sys.argv[1]:
-        print("Usage: <script> <arg1=directory of file>")
+        print("Usage: <script> <arg1=directory of file> [-c] [-y]")
         print("Suggested usage: <script> ./ground_truth/deck1")
+        print("  -c captures from the continuous (video port) stream")
+        print("  -y captures the camera's native yuv output (ground truth & runtime modes must match)")
     else:
         _dir = sys.argv[1]
         print(f"Saving images to directory `{_dir}` -- file names = `{{dir}}/{{rank}}{{suit}}.npy`")
-        capture_image = init_camera()
+        capture_image = init_camera(continuous='-c' in sys.argv, native_yuv='-y' in sys.argv)
 
         while True:
             np.save(f"{_dir}/{input('Identity of the current scanned card: ')}.npy", capture_image())
@@ -1,15 +1,20 @@
+import asyncio
+import os
 import sys
-from time import sleep
-from typing import Callable, List, Dict
+from enum import Enum
+from time import perf_counter
+from typing import Callable, List, Dict, Optional, Awaitable
 from threading import Thread
 import numpy as np
 
-from uart import UART, TxActions, RxActions
+from uart import UART, AsyncUART, TxActions, RxActions, BAUD_RATES
 import identify_card as cv
 from identify_card import Image, Card
 from orderer import OrderGenerator
-from camera import init_camera
+from image_source import open_image_source
 from webserver import start_webserver
+from scoring_pool import ScoringPool
+from metrics import Metrics
 
 
 def noop(*args):
@@ -21,19 +26,32 @@ _dbprint = noop
 _string_buffer: str = ""
 
 
+def _apply_config(string: str) -> None:
+    # format for each string is "<field>:<value>", where <field>
+    # and <value> are only `[^:]*`, and the delimiter is ':'
+    key, value = string.split(":")
+    OrderGenerator.reconfigure(key, value, mcu=True)
+
+
 def _build_string(char: str) -> None:
     global _string_buffer
     if char != '\0':
         _string_buffer += char
     else:
         _dbprint(f"Built config string \"{_string_buffer}\"")
-        # format for each string is "<field>:<value>", where <field>
-        # and <value> are only `[^:]*`, and the delimiter is ':'
-        key, value = _string_buffer.split(":")
-        OrderGenerator.reconfigure(key, value, mcu=True)
+        _apply_config(_string_buffer)
         _string_buffer = ""  # clear buffer
 
 
+def _receive_config(action: RxActions, data: str) -> None:
+    # legacy protocol sends config strings one char at a time, the framed protocol whole
+    if action == RxActions.RX_STRING:
+        _build_string(data)
+    else:
+        _dbprint(f"Received config string \"{data}\"")
+        _apply_config(data)
+
+
 _use_sbc_config: bool = False
 
 
@@ -49,7 +67,8 @@ def _handle_webserver_config(configs: List[str]) -> None:
         pass
 
 
-def _populate_ground_truth_images(*, num_decks: int, verbose: bool = False) -> None:
+def _populate_ground_truth_images(*, num_decks: int, cache_dir: Optional[str] = "./ground_truth/.cache",
+                                  roi: bool = False, prototypes: Optional[int] = None, verbose: bool = False) -> None:
     _ranks = ["A", "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K"]
     _suits = ["C", "H", "S", "D"]
 
@@ -60,147 +79,340 @@ def _populate_ground_truth_images(*, num_decks: int, verbose: bool = False) -> N
                 np.load(f"./ground_truth/deck{deck + 1}/{rank}{suit}.npy") for deck in range(num_decks)
             ]
 
-    cv.populate_ground_truth(cards_dict, verbose=verbose)
-
-
-class _SystemReset(Exception):
-    pass
-
-
-# noinspection PyShadowingNames
-def _exec_logic(uart: UART, image_fetcher: Callable[[], Image], verbose_cv: bool) -> None:
-    # reset global flags
-    global _use_sbc_config
-    _use_sbc_config = False
-    # TODO decide whether to reset config trackers in OrderGenerator
+    if cache_dir is None:
+        cv.populate_ground_truth(cards_dict, roi=roi, prototypes=prototypes, verbose=verbose)
+        return
+
+    # derived data is cached under a content hash of the frames + preprocessing params, so stale data is never used
+    cache_path = os.path.join(cache_dir, cv.ground_truth_cache_key(cards_dict, roi=roi, prototypes=prototypes))
+    if not cv.load_ground_truth(cache_path, verbose=verbose):
+        cv.populate_ground_truth(cards_dict, roi=roi, prototypes=prototypes, verbose=verbose)
+        os.makedirs(cache_dir, exist_ok=True)
+        cv.save_ground_truth(cache_path)
+
+
+class _State(Enum):
+    BOOT = "Waiting for the micro to init"
+    HANDSHAKE = "Wake/RESET handshake"
+    SETTINGS = "Waiting for MCU start and/or settings"
+    NEGOTIATE = "Requesting µC for card processing with RasPi/webserver settings"
+    CARDS = "Card processing"
+    CORRECTIONS = "Sending card location corrections"
+    DONE = "Shuffle complete"
+
+
+# per-stage latencies of every card cycle, served by the webserver @ `/metrics`
+_metrics = Metrics()
+
+# how often the settings wait checks for a webserver config, while no UART packet arrives
+_CONFIG_POLL_MS: int = 50
+
+
+_CONFIG_ACTIONS = (RxActions.RX_STRING, RxActions.RX_CONFIG)
+
+_BOOT_DELAY: float = 10  # seconds -- fixes potential boot loop by allowing micro to init first
+# very hacky (^^^) -- TODO fix micro handshake to prevent boot loop...
+
+
+class _ShuffleStateMachine:
+    # one shuffle of the protocol -- every phase is a state handler that returns the next state, and a RESET from the
+    # MCU is a transition back to BOOT. Frame capture & card recognition run in the loop's default executor, so UART
+    # packets keep being received (and anything else sharing the event loop keeps running) while a card is identified
+    uart: AsyncUART
+    target_order: Dict[Card, int]
+    session: Optional[cv.IdentificationSession]
+
+    # noinspection PyShadowingNames
+    def __init__(self, uart: AsyncUART, image_fetcher: Callable[[], Image], verbose_cv: bool,
+                 scorer: Optional[cv.BankScorer] = None, roi: bool = False, shortlist: Optional[int] = None, *,
+                 baud_rate: Optional[int] = None, boot_delay: float = _BOOT_DELAY):
+        self.uart = uart
+        self.image_fetcher = image_fetcher
+        self.verbose_cv = verbose_cv
+        self.scorer = scorer
+        self.roi = roi
+        self.shortlist = shortlist
+        self.baud_rate = baud_rate  # offered for the framed protocol after every handshake (None = legacy only)
+        self.boot_delay = boot_delay
+        self.target_order = {}
+        self.session = None
+        self._handlers: Dict[_State, Callable[[], Awaitable[_State]]] = {
+            _State.BOOT: self._boot,
+            _State.HANDSHAKE: self._handshake,
+            _State.SETTINGS: self._settings,
+            _State.NEGOTIATE: self._negotiate,
+            _State.CARDS: self._cards,
+            _State.CORRECTIONS: self._corrections,
+        }
+
+    async def run(self) -> None:
+        state = _State.BOOT
+        while state != _State.DONE:
+            _dbprint(f"Entering state {state.name}: {state.value}")
+            state = await self._handlers[state]()
+        _dbprint("Finishing execution loop")
+
+    @staticmethod
+    def _reset(where: str) -> _State:
+        _dbprint(f"Received RESET @ {where}")
+        return _State.BOOT
+
+    async def _boot(self) -> _State:
+        # reset global flags
+        global _use_sbc_config
+        _use_sbc_config = False
+        # TODO decide whether to reset config trackers in OrderGenerator
+        self.uart.reset_protocol()
+        await asyncio.sleep(self.boot_delay)
+        return _State.HANDSHAKE
 
-    _dbprint("Starting execution loop")
-    sleep(10)  # fixes potential boot loop by allowing micro to init first
-    # very hacky (^^^) -- TODO fix micro handshake to prevent boot loop...
-
-    # wake/reset handshake
-    _dbprint("Starting Wake/RESET handshake")
-    while True:
-        uart.tx(TxActions.RESET)
-        response = uart.rx_timeout()
-        if response is not None:
-            action, _ = response
-            if action == RxActions.RESET:
-                break
-    sleep(0.5)
-    while uart.rx() is not None:
-        continue  # clear all pending RESET transmissions -- prevents "boot-loop"
-    _dbprint("Handshake completed")
-
-    # get user settings
-    _dbprint("Waiting for MCU start and/or settings")
-    while not _use_sbc_config:  # bypass config stuff if we are using RasPi configs
-        packet = uart.rx()
-        if packet is not None:
-            action, char = packet
-            if action == RxActions.RX_STRING:
-                _build_string(char)
-            elif action == RxActions.START_SHUFFLE_MCU:
-                break
-            elif action == RxActions.RESET:
-                raise _SystemReset("@ loop for settings/start wait")
-        else:
-            sleep(0.001)
+    async def _handshake(self) -> _State:
+        while True:
+            self.uart.tx(TxActions.RESET)
+            response = await self.uart.rx_timeout()
+            if response is not None:
+                action, _ = response
+                if action == RxActions.RESET:
+                    break
+        await asyncio.sleep(0.5)
+        while self.uart.rx() is not None:
+            continue  # clear all pending RESET transmissions -- prevents "boot-loop"
+        _dbprint("Handshake completed")
+        if self.baud_rate is not None:
+            framed = await self.uart.negotiate(self.baud_rate)
+            _dbprint(f"Protocol negotiation {'succeeded' if framed else 'failed... staying on the legacy protocol'}")
+        return _State.SETTINGS
+
+    async def _settings(self) -> _State:
+        while not _use_sbc_config:  # bypass config stuff if we are using RasPi configs
+            packet = await self.uart.rx_timeout(_CONFIG_POLL_MS)  # wakes up periodically to notice webserver configs
+            if packet is not None:
+                action, char = packet
+                if action in _CONFIG_ACTIONS:
+                    _receive_config(action, char)
+                elif action == RxActions.START_SHUFFLE_MCU:
+                    return self._start(mcu=True)
+                elif action == RxActions.RESET:
+                    return self._reset("loop for settings/start wait")
+        return _State.NEGOTIATE
 
-    if _use_sbc_config:
-        _dbprint("Requesting µC for card processing with RasPi/webserver settings")
+    async def _negotiate(self) -> _State:
+        global _use_sbc_config
         while True:
-            uart.tx(TxActions.START_SHUFFLE_SBC)
-            response = uart.rx_timeout()
+            self.uart.tx(TxActions.START_SHUFFLE_SBC)
+            response = await self.uart.rx_timeout()
             if response is not None:
                 action, char = response
-                if action == RxActions.RX_STRING:
-                    _build_string(char)
+                if action in _CONFIG_ACTIONS:
+                    _receive_config(action, char)
                 elif action == RxActions.START_SHUFFLE_MCU:
                     _use_sbc_config = False
                     _dbprint("Switching to MCU config settings")
-                    break
+                    return self._start(mcu=True)
                 elif action == RxActions.START_SHUFFLE_SBC:
-                    break
+                    return self._start(mcu=False)
                 elif action == RxActions.RESET:
-                    raise _SystemReset("@ loop for SBC vs MCU setting shuffle start wait")
+                    return self._reset("loop for SBC vs MCU setting shuffle start wait")
 
-    if _use_sbc_config:
-        _dbprint("Starting card processing with RasPi/webserver settings")
-        # prep for shuffle
-        target_order = OrderGenerator.generate_order(mcu=False)
-    else:
-        _dbprint("Starting card processing with µC settings")
-        # send start ack
-        uart.tx(TxActions.START_SHUFFLE_MCU)
+    def _start(self, *, mcu: bool) -> _State:
+        if mcu:
+            _dbprint("Starting card processing with µC settings")
+            self.uart.tx(TxActions.START_SHUFFLE_MCU)  # send start ack
+        else:
+            _dbprint("Starting card processing with RasPi/webserver settings")
         # prep for shuffle
-        target_order = OrderGenerator.generate_order(mcu=True)
+        self.target_order = OrderGenerator.generate_order(mcu=mcu)
+        # no narrowing down to the deck's remaining cards: it has been less accurate than plain `identify_card` so
+        # far (see `cv.IdentificationSession`) -- the session only adds the post-deck assignment
+        self.session = cv.IdentificationSession(shortlist=self.shortlist, narrow=False, scorer=self.scorer)
+        return _State.CARDS
+
+    async def _cards(self) -> _State:
+        # this should be the index of the NEXT expected.
+        # the count the mcu sends should be the number TO BE processed (ie sbc_count==mcu_count)
+        loop = asyncio.get_running_loop()
+        _metrics.start_deck()
+        for i in range(52):
+            t_wait = perf_counter()
+            while True:
+                action, data = await self.uart.rx_blocking()
+                while action != RxActions.CAPTURE_IMAGE:
+                    if action == RxActions.RESET:
+                        return self._reset("loop for card recognition/processing")
+                    if action in _CONFIG_ACTIONS:
+                        _receive_config(action, data)
+                    action, data = await self.uart.rx_blocking()
+                if data != i:
+                    _dbprint("Received image capture clearance, but index/key is out of sync... Retrying handshake...")
+                    self.uart.tx(TxActions.REINDEX_SLOT, i)
+                else:
+                    _dbprint("Received image capture clearance")
+                    break
 
-    # shuffle process
-    # this should be the index of the NEXT expected.
-    # the count the mcu sends should be the number TO BE processed (ie sbc_count==mcu_count)
-    _dbprint("Starting card processing")
-    for i in range(52):
-        while True:
-            action, data = uart.rx_blocking()
-            while action != RxActions.CAPTURE_IMAGE:
-                if action == RxActions.RESET:
-                    raise _SystemReset("@ loop for card recognition/processing")
-                if action == RxActions.RX_STRING:
-                    _build_string(data)
-                action, data = uart.rx_blocking()
-            if data != i:
-                _dbprint("Received image capture clearance, but index/key is out of sync... Retrying handshake...")
-                uart.tx(TxActions.REINDEX_SLOT, i)
-            else:
-                _dbprint("Received image capture clearance")
-                break
-
-        # this slot should be RELATIVE slots not ABSOLUTE slot. MCU is responsible for translating from R to A
-        img = image_fetcher()
-        edges, bboxes = cv.preprocess_image(img, verbose=verbose_cv)
-        card, score_map = cv.identify_card(edges, bboxes, verbose=verbose_cv)  # TODO use score_map for card corrections
-        slot = target_order[card]
-        _dbprint(f"Identified current (index={i}) card as (card={card[0]}{card[1]}) to be placed into (slot={slot})")
-        uart.tx(TxActions.IDENTIFY_SLOT, slot)
-        # NTS store card location corrections here (stretch goal #2)
-    _dbprint("Card processing complete")
-
-    # NTS send all card location corrections here (stretch goal #2) via
-    #  uart.tx(TxActions.REINDEX_SLOT, ...) & uart.tx(TxActions.IDENTIFY_SLOT, ...) packets
-    _dbprint("Finishing execution loop")
+            # this slot should be RELATIVE slots not ABSOLUTE slot. MCU is responsible for translating from R to A
+            t_capture = perf_counter()
+            img = await loop.run_in_executor(None, self.image_fetcher)
+            t_preprocess = perf_counter()
+            edges, bboxes = await loop.run_in_executor(
+                None, lambda: cv.preprocess_image(img, roi=self.roi, verbose=self.verbose_cv))
+            t_identify = perf_counter()
+            card, _ = await loop.run_in_executor(None, lambda: self.session.identify(edges, bboxes,
+                                                                                     verbose=self.verbose_cv))
+            slot = self.target_order[card]
+            _dbprint(f"Identified current (index={i}) card as (card={card[0]}{card[1]}) to be placed into "
+                     f"(slot={slot})")
+            t_transmit = perf_counter()
+            self.uart.tx(TxActions.IDENTIFY_SLOT, slot)
+            t_end = perf_counter()
+
+            _metrics.record("uart_wait", t_capture - t_wait)
+            _metrics.record("capture", t_preprocess - t_capture)
+            _metrics.record("preprocess", t_identify - t_preprocess)
+            _metrics.record("identify", t_transmit - t_identify)
+            _metrics.record("transmit", t_end - t_transmit)
+            _metrics.record("cycle", t_end - t_wait)
+        _metrics.end_deck()
+        _dbprint("Card processing complete")
+        return _State.CORRECTIONS
+
+    async def _corrections(self) -> _State:
+        # each card appears exactly once per deck, so the deck's score matrix is re-assigned one-to-one, and every
+        # card whose assignment changed is re-sent as a (REINDEX_SLOT, IDENTIFY_SLOT) packet pair
+        corrections = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: self.session.corrections(verbose=self.verbose_cv))
+        _dbprint(f"Sending {len(corrections)} card location correction(s)")
+        if len(corrections) == 0:
+            return _State.DONE
+        if self.uart.framed:  # batched into a single frame
+            self.uart.tx(TxActions.IDENTIFY_SLOTS, [(i, self.target_order[card]) for i, card in corrections])
+            return _State.DONE
+        for i, card in corrections:
+            slot = self.target_order[card]
+            _dbprint(f"Corrected (index={i}) card from (card={''.join(self.session.identified[i])}) to "
+                     f"(card={''.join(card)}) to be placed into (slot={slot})")
+            self.uart.tx(TxActions.REINDEX_SLOT, i)
+            self.uart.tx(TxActions.IDENTIFY_SLOT, slot)
+        return _State.DONE
+
+
+# noinspection PyShadowingNames
+async def _exec_logic(uart: AsyncUART, image_fetcher: Callable[[], Image], verbose_cv: bool,
+                      scorer: Optional[cv.BankScorer] = None, roi: bool = False, shortlist: Optional[int] = None,
+                      *, baud_rate: Optional[int] = None, boot_delay: float = _BOOT_DELAY) -> None:
+    _dbprint("Starting execution loop")
+    await _ShuffleStateMachine(uart, image_fetcher, verbose_cv, scorer, roi, shortlist, baud_rate=baud_rate,
+                               boot_delay=boot_delay).run()
 
 
 if __name__ == '__main__':
     verbose_cv: bool = False
-
-    if len(sys.argv) == 3:
-        if sys.argv[1] != '-v':
-            print("Second argument must be exactly `-v`")
-            sys.exit(1)
-        flags = sys.argv[2]
-        if 'L' in flags or 'l' in flags:
-            _dbprint = print
-        if 'U' in flags or 'u' in flags:
-            UART.verbose = True
-        if 'C' in flags or 'c' in flags:
-            verbose_cv = True
-    elif len(sys.argv) != 1:
-        print(f"{sys.argv[0]} takes either 0 or 2 arguments only")
+    num_workers: int = 0
+    use_roi: bool = False
+    fused_preprocessing: bool = False
+    shortlist: Optional[int] = None
+    num_decks: int = 1
+    prototypes: Optional[int] = None
+    continuous: bool = False
+    native_yuv: bool = False
+    image_source: str = "camera"
+    baud_rate: Optional[int] = None
+    uart_port: str = "/dev/ttyS0"
+    uart_trace: Optional[str] = None
+
+    options = ('-v', '-j', '-r', '-f', '-s', '-d', '-p', '-c', '-y', '-i', '-b', '-u', '-t')
+    args = sys.argv[1:]
+    if len(args) % 2 != 0 or any(opt not in options for opt in args[::2]):
+        print(f"{sys.argv[0]} takes only `<option> <value>` pairs")
         print("0 args: Normal operation")
-        print("2 args: -v ???")
+        print("-v ???")
         print("  - enables verbose mode, and subsequent flags (`L`, `U`, `C`) enables verbosity"
               " for core logic, UART, and card recognition, respectively...")
+        print("-j <workers>")
+        print("  - EXPERIMENTAL: scores cards on a pool of <workers> processes (0 = in-process, default) -- slower than"
+              " in-process so far, see `scoring_pool.py`")
+        print("-r <0|1>")
+        print("  - 1 restricts card recognition to the rank/suit corner index region (0 = full frame, default) --"
+              " more accurate on the benchmark corpora (57.7% vs 49.8% augmented), but not faster")
+        print("-f <0|1>")
+        print("  - 1 uses the fused preprocessing (0 = reference, default) -- ~3x faster, but only bit-identical on x86"
+              " so far: check `benchmark.py` on the target first")
+        print("-s <count>")
+        print("  - only scores the ground truth images of the <count> cards with the nearest bbox layout (0 = all,"
+              " default) -- lossy: 16 is within 0.2 points of scoring all on the augmented corpus, 8 loses 6")
+        print("-d <decks>")
+        print("  - number of ground truth decks to load from `./ground_truth/deck{1..<decks>}` (default 1)")
+        print("-p <count>")
+        print("  - merges each card's ground truth decks into at most <count> prototypes (0 = no merging, default)")
+        print("-i <source>")
+        print("  - frame source: `camera` (default), `replay:<dir>[:<interval ms>]` (recorded `.npy` frames) or"
+              " `synthetic:<dir>[:<strength>]` (augmented reference frames)")
+        print("-b <baud>")
+        print(f"  - offers the framed protocol @ <baud> (one of {', '.join(map(str, BAUD_RATES[1:]))}) after every"
+              " handshake (0 = legacy one-byte protocol only, default)")
+        print("-u <device>")
+        print("  - serial device of the MCU (default `/dev/ttyS0`), i.e. the pty printed by `mcu_emulator.py`")
+        print("-t <path>")
+        print("  - records a timestamped binary trace of the UART traffic to <path> (see `uart_trace.py`)")
+        print("-c <0|1>")
+        print("  - 1 streams frames continuously from the camera's video port (0 = still capture per card, default)")
+        print("-y <0|1>")
+        print("  - 1 captures the camera's native yuv output (0 = converted from rgb, default) -- needs ground truth"
+              " captured the same way (`camera.py -y`)")
         sys.exit(1)
-
-    uart = UART(baud_rate=9600)
-    _populate_ground_truth_images(num_decks=1, verbose=verbose_cv)
-    image_fetcher = init_camera()
-    Thread(target=lambda: start_webserver(_handle_webserver_config)).start()  # start webserver in new thread
-
-    while True:
+    for opt, value in zip(args[::2], args[1::2]):
+        if opt == '-v':
+            if 'L' in value or 'l' in value:
+                _dbprint = print
+            if 'U' in value or 'u' in value:
+                UART.verbose = True
+            if 'C' in value or 'c' in value:
+                verbose_cv = True
+        elif opt == '-j':
+            num_workers = int(value)
+        elif opt == '-r':
+            use_roi = value == '1'
+        elif opt == '-f':
+            fused_preprocessing = value == '1'
+        elif opt == '-s':
+            shortlist = int(value) if int(value) > 0 else None
+        elif opt == '-d':
+            num_decks = int(value)
+        elif opt == '-p':
+            prototypes = int(value) if int(value) > 0 else None
+        elif opt == '-c':
+            continuous = value == '1'
+        elif opt == '-y':
+            native_yuv = value == '1'
+        elif opt == '-i':
+            image_source = value
+        elif opt == '-u':
+            uart_port = value
+        elif opt == '-t':
+            uart_trace = value
+        elif opt == '-b':
+            baud_rate = int(value) if int(value) > 0 else None
+
+    cv.use_fused_preprocessing(fused_preprocessing)
+    _populate_ground_truth_images(num_decks=num_decks, roi=use_roi, prototypes=prototypes, verbose=verbose_cv)
+    # workers are started once and stay warm across every `_exec_logic` run
+    scorer = ScoringPool(workers=num_workers) if num_workers > 0 else None
+    if scorer is not None:
+        print(f"WARNING: the scoring pool (-j {num_workers}) is experimental, and has been slower than in-process "
+              "scoring on every benchmark so far")
+    image_fetcher = open_image_source(image_source, continuous=continuous, native_yuv=native_yuv)
+    # start webserver in new thread
+    Thread(target=lambda: start_webserver(_handle_webserver_config, metrics_handler=_metrics.render)).start()
+
+    async def _run() -> None:
+        uart = AsyncUART(UART(baud_rate=9600, port=uart_port, trace=uart_trace))
         try:
-            _exec_logic(uart, image_fetcher, verbose_cv)
-        except _SystemReset as e:
-            _dbprint(e)
-            pass
+            while True:
+                await _exec_logic(uart, image_fetcher, verbose_cv, scorer, use_roi, shortlist, baud_rate=baud_rate)
+        finally:
+            uart.uart.close()  # flushes the trace
+
+    try:
+        asyncio.run(_run())
+    finally:
+        if scorer is not None:
+            scorer.close()  # workers & shared memory blocks -- also when the UART cannot be opened
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from time import sleep, perf_counter
+from typing import Callable, List, Optional
+import os
+import numpy as np
+
+from identify_card import Image
+import augment
+
+
+class ImageSource(ABC):
+    # provides the frames for card recognition -- callable, so that it can be used as `core._exec_logic`'s image_fetcher
+    @abstractmethod
+    def fetch(self) -> Image:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __call__(self) -> Image:
+        return self.fetch()
+
+
+class PiCameraSource(ImageSource):
+    # the real camera (see `camera.init_camera`) -- picamera is only imported when this source is used
+    def __init__(self, *, continuous: bool = False, native_yuv: bool = False):
+        from camera import init_camera
+        self._capture: Callable[[], Image] = init_camera(continuous=continuous, native_yuv=native_yuv)
+
+    def fetch(self) -> Image:
+        return self._capture()
+
+
+class ReplaySource(ImageSource):
+    # replays a directory of recorded `.npy` frames (in file name order, looping) -- `interval` is the minimum time
+    # (seconds) between two fetched frames, to emulate the camera's frame timing
+    def __init__(self, directory: str, *, interval: float = 0.0, mmap: bool = True, loop: bool = True):
+        self._paths: List[str] = [os.path.join(directory, name)
+                                  for name in sorted(os.listdir(directory)) if name.endswith(".npy")]
+        assert len(self._paths) > 0, f"No `.npy` frames in `{directory}`"
+        self._interval = interval
+        self._mmap_mode: Optional[str] = 'r' if mmap else None
+        self._loop = loop
+        self._index = 0
+        self._last = -np.inf
+
+    def fetch(self) -> Image:
+        if self._index == len(self._paths):
+            if not self._loop:  # NB: not StopIteration, which cannot propagate through `run_in_executor`'s future
+                raise EOFError("Replay exhausted")
+            self._index = 0
+        img = np.load(self._paths[self._index], mmap_mode=self._mmap_mode)
+        self._index += 1
+
+        wait = self._last + self._interval - perf_counter()
+        if wait > 0:
+            sleep(wait)
+        self._last = perf_counter()
+        return img
+
+
+class SyntheticSource(ImageSource):
+    # endless augmented frames (see `augment.augment_frame`), cycling through the reference frames in `directory`
+    def __init__(self, directory: str, *, strength: float = 1.0, seed: int = 0):
+        self._sources = augment.load_sources(directory)
+        self._strength = strength
+        self._rng = np.random.default_rng(seed)
+        self._index = 0
+
+    def fetch(self) -> Image:
+        _, img = self._sources[self._index % len(self._sources)]
+        self._index += 1
+        return augment.augment_frame(img, self._rng, strength=self._strength)
+
+
+def open_image_source(spec: str, *, continuous: bool = False, native_yuv: bool = False) -> ImageSource:
+    # `spec` is one of:
+    #   camera                                    -- the pi camera (`continuous` & `native_yuv` as in `init_camera`)
+    #   replay:<directory>[:<interval ms>]        -- recorded frames, see `ReplaySource`
+    #   synthetic:<directory>[:<strength>]        -- augmented reference frames, see `SyntheticSource`
+    kind, *args = spec.split(':')
+    if kind == 'camera':
+        return PiCameraSource(continuous=continuous, native_yuv=native_yuv)
+    if kind == 'replay':
+        assert 1 <= len(args) <= 2, f"Invalid image source `{spec}`"
+        return ReplaySource(args[0], interval=float(args[1]) / 1000 if len(args) > 1 else 0.0)
+    if kind == 'synthetic':
+        assert 1 <= len(args) <= 2, f"Invalid image source `{spec}`"
+        return SyntheticSource(args[0], strength=float(args[1]) if len(args) > 1 else 1.0)
+    assert False, f"Unrecognized image source `{spec}`"
+
+
+if __name__ == '__main__':
+    import sys
+
+    if not len(sys.argv) > 1 or 'help' in sys.argv[1]:
+        print("Usage: <script> <arg1=image source> [<arg2=#frames>]")
+        print("Suggested usage: <script> replay:./ground_truth/deck1:50 52")
+    else:
+        _source = open_image_source(sys.argv[1])
+        _n = int(sys.argv[2]) if len(sys.argv) > 2 else 52
+        _start = perf_counter()
+        for _ in range(_n):
+            _img = _source()
+        _elapsed = perf_counter() - _start
+        print(f"Fetched {_n} frames of shape {_img.shape} in {_elapsed:.3f} s ({_n / _elapsed:.1f} frames/s)")
+        _source.close()
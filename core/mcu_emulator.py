@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+from random import Random
+from threading import Thread
+from time import sleep, perf_counter
+from typing import List, Tuple, Optional, Union, Iterable
+import os
+import pty
+import select
+import tty
+
+# noinspection PyProtectedMember
+from uart import FrameDecoder, encode_frame, BAUD_RATES, TxActions, TxArg, _TX_FRAME_PAYLOADS, _translate_tx_packet, \
+    _translate_tx_frame
+
+# SBC -> MCU packet, as seen by the MCU: (action, arg)
+_McuPacket = Tuple[TxActions, TxArg]
+
+# MCU -> SBC frame types (see `uart._RX_FRAME_TYPES`)
+_RESET, _START_MCU, _START_SBC, _CAPTURE_IMAGE, _CONFIG, _PING = 0x00, 0x02, 0x03, 0x10, 0x11, 0x30
+
+
+class _Restart(Exception):
+    # the deck has to start over from the RESET handshake (injected or received RESET)
+    pass
+
+
+class EmulatorStats:
+    round_trips: List[float]  # CAPTURE_IMAGE sent -> IDENTIFY_SLOT received, seconds
+    deck_times: List[float]  # RESET handshake -> last slot (+ corrections), seconds
+    decks: int
+    desyncs: int  # injected wrong CAPTURE_IMAGE indices
+    resets: int  # injected RESETs
+    drops: int  # dropped bytes (both directions)
+    resends: int  # CAPTURE_IMAGE re-sent after a timeout
+    lost_slots: int  # cards skipped by a REINDEX_SLOT before their slot arrived
+    corrections: int
+    protocol_errors: int
+
+    def __init__(self):
+        self.round_trips, self.deck_times = [], []
+        self.decks = self.desyncs = self.resets = self.drops = self.resends = 0
+        self.lost_slots = self.corrections = self.protocol_errors = 0
+
+
+class MCUEmulator:
+    # emulates the microcontroller's side of the shuffle protocol (see `core._ShuffleStateMachine`) on a pseudo-terminal
+    # -- connect the SBC with `UART(port=emulator.port)`. Each deck: answer the RESET handshake (& protocol negotiation
+    # if `framed`), send `configs` & START_SHUFFLE_MCU, then request every card with CAPTURE_IMAGE and wait
+    # `mechanical_delay` after its IDENTIFY_SLOT. Desyncs (wrong CAPTURE_IMAGE index), RESETs and byte drops (both
+    # directions) are injected per card/byte with the given rates
+    port: str
+    stats: EmulatorStats
+
+    def __init__(self, *, framed: bool = False, mechanical_delay: float = 0.05, desync_rate: float = 0.0,
+                 reset_rate: float = 0.0, drop_rate: float = 0.0, resend_timeout: float = 1.0,
+                 correction_window: float = 0.2, configs: Iterable[str] = ("game:shuffle",), seed: int = 0):
+        self.framed_supported = framed
+        self.mechanical_delay = mechanical_delay
+        self.desync_rate = desync_rate
+        self.reset_rate = reset_rate
+        self.drop_rate = drop_rate
+        self.resend_timeout = resend_timeout
+        self.correction_window = correction_window
+        self.configs = list(configs)
+        self.stats = EmulatorStats()
+
+        self._random = Random(seed)
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._framed = False
+        self._decoder = FrameDecoder(_TX_FRAME_PAYLOADS)
+        self._pending: List[_McuPacket] = []
+        self._running = False
+        self._thread: Optional[Thread] = None
+
+    def start(self) -> MCUEmulator:
+        self._running = True
+        self._thread = Thread(target=self._run, name="mcu-emulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    # --- transport ---
+
+    def _send(self, frame_type: int, arg: Union[int, str, None] = None) -> None:
+        if self._framed:
+            payload = b"" if arg is None else arg.encode('ascii') if isinstance(arg, str) else arg.to_bytes(2, 'big')
+            data = encode_frame(frame_type, payload)
+        elif frame_type == _CAPTURE_IMAGE:
+            data = bytes([0x40 | arg])
+        elif frame_type == _CONFIG:
+            data = bytes(0x80 | ord(char) for char in arg + '\0')
+        else:
+            assert frame_type in (_RESET, _START_MCU, _START_SBC), f"No legacy packet for frame type {frame_type}"
+            data = bytes([frame_type])
+        if self.drop_rate > 0:
+            kept = bytes(byte for byte in data if self._random.random() >= self.drop_rate)
+            self.stats.drops += len(data) - len(kept)
+            data = kept
+        os.write(self._master, data)
+
+    def _receive(self, timeout: float) -> Optional[_McuPacket]:
+        deadline = perf_counter() + timeout
+        while len(self._pending) == 0:
+            remaining = deadline - perf_counter()
+            if remaining <= 0 or not self._running:
+                return None
+            readable, _, _ = select.select([self._master], [], [], min(remaining, 0.1))
+            if not readable:
+                continue
+            data = os.read(self._master, 256)
+            if self.drop_rate > 0:
+                kept = bytes(byte for byte in data if self._random.random() >= self.drop_rate)
+                self.stats.drops += len(data) - len(kept)
+                data = kept
+            try:
+                if self._framed:
+                    self._pending += [_translate_tx_frame(*frame) for frame in self._decoder.feed(data)]
+                else:
+                    self._pending += [_translate_tx_packet(packet) for packet in data]
+            except (AssertionError, ValueError):
+                self.stats.protocol_errors += 1
+        return self._pending.pop(0)
+
+    def _set_framed(self, framed: bool) -> None:
+        self._framed = framed
+        self._decoder = FrameDecoder(_TX_FRAME_PAYLOADS)
+        self._pending.clear()
+
+    # --- protocol ---
+
+    def _run(self) -> None:
+        while self._running:
+            try:
+                self._deck()
+            except _Restart:
+                continue
+
+    def _expect(self, *actions: TxActions, timeout: Optional[float] = None) -> Optional[_McuPacket]:
+        # next packet with one of `actions` (others are dropped) -- a RESET from the SBC restarts the deck
+        deadline = perf_counter() + (timeout if timeout is not None else float('inf'))
+        while self._running and perf_counter() < deadline:
+            packet = self._receive(min(deadline - perf_counter(), 0.5))
+            if packet is None:
+                continue
+            if packet[0] in actions:
+                return packet
+            if packet[0] == TxActions.RESET and TxActions.RESET not in actions:
+                raise _Restart()
+        return None
+
+    def _handshake(self) -> None:
+        if self._framed:
+            self._set_framed(False)
+        while self._expect(TxActions.RESET) is None:
+            if not self._running:
+                raise _Restart()
+        self._send(_RESET)
+        packet = self._expect(TxActions.NEGOTIATE, TxActions.RESET, timeout=0.7)
+        while packet is not None and packet[0] == TxActions.RESET:  # handshake retries
+            packet = self._expect(TxActions.NEGOTIATE, TxActions.RESET, timeout=0.7)
+        if packet is not None and self.framed_supported:
+            os.write(self._master, bytes([0x04 | packet[1]]))  # legacy NEGOTIATE echo, never dropped
+            self._set_framed(True)
+            if self._expect(TxActions.PING, timeout=1.0) is None:
+                self._set_framed(False)
+                return
+            self._send(_PING)
+
+    def _deck(self) -> None:
+        self._handshake()
+        start = perf_counter()
+        for config in self.configs:
+            self._send(_CONFIG, config)
+        self._send(_START_MCU)
+        if self._expect(TxActions.START_SHUFFLE_MCU, TxActions.START_SHUFFLE_SBC, timeout=5.0) is None:
+            raise _Restart()
+
+        i = 0
+        while i < 52:
+            if self._random.random() < self.reset_rate:
+                self.stats.resets += 1
+                self._send(_RESET)
+                self._set_framed(False)
+                raise _Restart()
+            if self._random.random() < self.desync_rate:
+                self.stats.desyncs += 1
+                self._send(_CAPTURE_IMAGE, (i + 1 + self._random.randrange(50)) % 52)
+                packet = self._expect(TxActions.REINDEX_SLOT, timeout=self.resend_timeout)
+                if packet is not None:
+                    i = packet[1]
+
+            sent = perf_counter()
+            self._send(_CAPTURE_IMAGE, i)
+            packet = self._expect(TxActions.IDENTIFY_SLOT, TxActions.REINDEX_SLOT, timeout=self.resend_timeout)
+            if packet is None:
+                self.stats.resends += 1
+                continue
+            if packet[0] == TxActions.REINDEX_SLOT:  # the SBC already moved on
+                self.stats.lost_slots += max(0, packet[1] - i)
+                i = packet[1]
+                continue
+            self.stats.round_trips.append(perf_counter() - sent)
+            sleep(self.mechanical_delay)  # card being moved into its slot
+            i += 1
+
+        # post-deck corrections, until the SBC goes quiet or starts the next deck
+        while (packet := self._expect(TxActions.IDENTIFY_SLOTS, TxActions.REINDEX_SLOT, TxActions.IDENTIFY_SLOT,
+                                      TxActions.RESET, timeout=self.correction_window)) is not None:
+            if packet[0] == TxActions.RESET:
+                self._pending.insert(0, packet)  # for the next handshake
+                break
+            if packet[0] != TxActions.IDENTIFY_SLOT:  # legacy corrections are (REINDEX_SLOT, IDENTIFY_SLOT) pairs
+                self.stats.corrections += len(packet[1]) if packet[0] == TxActions.IDENTIFY_SLOTS else 1
+        self.stats.deck_times.append(perf_counter() - start)
+        self.stats.decks += 1
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+if __name__ == '__main__':
+    import sys
+    import asyncio
+    import contextlib
+    import io
+
+    if len(sys.argv) > 1 and 'help' in sys.argv[1]:
+        print("Usage: <script> [<arg1=#decks>] [<arg2=mechanical delay ms>] [<arg3=desync rate>] [<arg4=reset rate>]"
+              " [<arg5=byte drop rate>] [-f] [-i <image source>] [-t <trace path>]")
+        print("Suggested usage: <script> 3 20 0.02 0.005 0.0005 -i replay:./ground_truth/deck1")
+        print("  runs core's protocol against the emulator (in-process), and reports per card/deck protocol overhead")
+        print("  -f negotiates the framed protocol")
+        print("  -t records the SBC's UART trace (see `uart_trace.py`)")
+        sys.exit(0)
+
+    import core
+    from uart import UART, AsyncUART
+    from image_source import open_image_source
+
+    _flags = [arg for arg in sys.argv[1:] if arg.startswith('-')]
+    _source = sys.argv[sys.argv.index('-i') + 1] if '-i' in sys.argv else "replay:./ground_truth/deck1"
+    _trace = sys.argv[sys.argv.index('-t') + 1] if '-t' in sys.argv else None
+    _args = [arg for arg in sys.argv[1:] if not arg.startswith('-') and arg not in (_source, _trace)]
+    _decks = int(_args[0]) if len(_args) > 0 else 1
+    _emulator = MCUEmulator(framed='-f' in _flags,
+                            mechanical_delay=float(_args[1]) / 1000 if len(_args) > 1 else 0.05,
+                            desync_rate=float(_args[2]) if len(_args) > 2 else 0.0,
+                            reset_rate=float(_args[3]) if len(_args) > 3 else 0.0,
+                            drop_rate=float(_args[4]) if len(_args) > 4 else 0.0).start()
+    print(f"MCU emulator on `{_emulator.port}`")
+
+    with contextlib.redirect_stdout(io.StringIO()):  # `populate_ground_truth` always prints separators
+        # noinspection PyProtectedMember
+        core._populate_ground_truth_images(num_decks=1)
+    _fetcher = open_image_source(_source)
+
+    # noinspection PyProtectedMember
+    async def _run() -> None:
+        # the SBC side loops over decks like `core`'s main, until the emulator has completed `_decks` of them
+        uart = AsyncUART(UART(baud_rate=BAUD_RATES[0], port=_emulator.port, trace=_trace))
+
+        async def shuffle() -> None:
+            while True:
+                await core._exec_logic(uart, _fetcher, False, baud_rate=BAUD_RATES[2] if '-f' in _flags else None,
+                                       boot_delay=0.1)
+
+        task = asyncio.create_task(shuffle())
+        while _emulator.stats.decks < _decks and not task.done():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        uart.uart.close()
+
+    _start = perf_counter()
+    asyncio.run(_run())
+    _elapsed = perf_counter() - _start
+    _emulator.stop()
+
+    _stats = _emulator.stats
+    # noinspection PyProtectedMember
+    _processing = sum(core._metrics.mean(stage) for stage in ("capture", "preprocess", "identify"))
+    _round_trip = sum(_stats.round_trips) / max(len(_stats.round_trips), 1)
+    print(f"{_stats.decks} deck(s) in {_elapsed:.2f} s -- deck time mean "
+          f"{sum(_stats.deck_times) / max(len(_stats.deck_times), 1):.3f} s")
+    print(f"card round trip: mean {_round_trip * 1000:.2f} ms | p50 {_percentile(_stats.round_trips, 0.5) * 1000:.2f}"
+          f" ms | p95 {_percentile(_stats.round_trips, 0.95) * 1000:.2f} ms | max "
+          f"{max(_stats.round_trips, default=0) * 1000:.2f} ms")
+    print(f"protocol overhead: {(_round_trip - _processing) * 1000:.2f} ms/card (round trip - capture/recognition), "
+          f"{(_round_trip - _processing) * 52:.3f} s/deck")
+    print(f"injected: {_stats.desyncs} desyncs, {_stats.resets} resets, {_stats.drops} dropped bytes -- "
+          f"{_stats.resends} resends, {_stats.lost_slots} lost slots, {_stats.corrections} corrections, "
+          f"{_stats.protocol_errors} protocol errors")
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+from time import perf_counter
+from typing import List, Dict, Deque, Tuple, Optional
+
+# upper bounds (ms) of the fixed histogram buckets -- everything above the last bound lands in the overflow bucket
+_BUCKET_BOUNDS_MS: Tuple[float, ...] = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+_MAX_DECKS: int = 16  # number of per-deck summaries kept
+
+# stages of one card cycle in `core._exec_logic`, in order
+STAGES: Tuple[str, ...] = ("uart_wait", "capture", "preprocess", "identify", "transmit", "cycle")
+
+
+class _Histogram:
+    # fixed-size latency histogram -- O(log #buckets) to record, no per-sample allocation
+    counts: List[int]
+    count: int
+    total: float  # seconds
+    max: float  # seconds
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKET_BOUNDS_MS) + 1)
+        self.count, self.total, self.max = 0, 0.0, 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect_left(_BUCKET_BOUNDS_MS, seconds * 1000)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+class _DeckSummary:
+    # per-stage (count, total seconds, max seconds) for one deck
+    index: int
+    stages: Dict[str, List[float]]
+
+    def __init__(self, index: int):
+        self.index = index
+        self.stages = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        stats = self.stages.setdefault(stage, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+
+class Metrics:
+    # always-on stage latency tracker -- written by the core loop, read (rendered) by the webserver thread
+    _histograms: Dict[str, _Histogram]
+    _decks: Deque[_DeckSummary]
+    _deck: Optional[_DeckSummary]
+    _num_decks: int
+
+    def __init__(self):
+        self._lock = Lock()
+        self._histograms = {stage: _Histogram() for stage in STAGES}
+        self._decks = deque(maxlen=_MAX_DECKS)
+        self._deck = None
+        self._num_decks = 0
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = _Histogram()
+            histogram.record(seconds)
+            if self._deck is not None:
+                self._deck.record(stage, seconds)
+
+    def mean(self, stage: str) -> float:
+        # mean latency (seconds) of `stage` so far
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            return histogram.total / histogram.count if histogram is not None and histogram.count > 0 else 0.0
+
+    def start_deck(self) -> None:
+        with self._lock:
+            self._num_decks += 1
+            self._deck = _DeckSummary(self._num_decks)
+            self._decks.append(self._deck)
+
+    def end_deck(self) -> None:
+        with self._lock:
+            self._deck = None
+
+    def render(self) -> str:
+        # plain-text exposition (prometheus style) of every histogram & the most recent deck summaries
+        lines = ["# TYPE stage_latency_ms histogram"]
+        with self._lock:
+            for stage, histogram in self._histograms.items():
+                seen = 0
+                for bound, n in zip(_BUCKET_BOUNDS_MS, histogram.counts):
+                    seen += n
+                    lines.append(f'stage_latency_ms_bucket{{stage="{stage}",le="{bound:g}"}} {seen}')
+                lines.append(f'stage_latency_ms_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'stage_latency_ms_count{{stage="{stage}"}} {histogram.count}')
+                lines.append(f'stage_latency_ms_sum{{stage="{stage}"}} {histogram.total * 1000:.3f}')
+            # quantiles are left to the scraper (`histogram_quantile` over the buckets)
+            lines.append("# TYPE stage_latency_ms_max gauge")
+            for stage, histogram in self._histograms.items():
+                lines.append(f'stage_latency_ms_max{{stage="{stage}"}} {histogram.max * 1000:.3f}')
+            lines.append("# TYPE decks_started counter")
+            lines.append(f"decks_started {self._num_decks}")
+            lines.append("# TYPE deck_stage_ms gauge")
+            for deck in self._decks:
+                for stage, (count, total, worst) in deck.stages.items():
+                    mean = total / count * 1000 if count else 0.0
+                    lines.append(f'deck_stage_ms{{deck="{deck.index}",stage="{stage}",stat="count"}} {count}')
+                    lines.append(f'deck_stage_ms{{deck="{deck.index}",stage="{stage}",stat="mean"}} {mean:.3f}')
+                    lines.append(f'deck_stage_ms{{deck="{deck.index}",stage="{stage}",stat="max"}} {worst * 1000:.3f}')
+        return "\n".join(lines) + "\n"
+
+
+if __name__ == '__main__':
+    import sys
+    from random import lognormvariate
+
+    _metrics = Metrics()
+    _n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    _start = perf_counter()
+    for _ in range(_n):
+        _metrics.record("identify", 0.001)
+    print(f"record overhead: {(perf_counter() - _start) / _n * 1e6:.3f} µs/sample")
+
+    _metrics.start_deck()
+    for _ in range(52):
+        for _stage in STAGES:
+            _metrics.record(_stage, lognormvariate(-6, 1))
+    _metrics.end_deck()
+    print(_metrics.render())
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Tuple, Optional, Any
+import numpy as np
+
+import identify_card as cv
+from identify_card import Image, ImageComparisonData
+
+# (shared memory block name, shape, dtype) -- enough for a worker to re-create the array without copying it
+_ArraySpec = Tuple[str, Tuple[int, ...], Any]
+# (edges, normalized bboxes, affine mapper params, test bboxes to match, truth indices to score or None) -- picklable
+# form of one worker's share of a scoring request
+_ScoreTask = Tuple[Image, List[Tuple[float, float, float, float]], Tuple[float, float, float, float], Image,
+                   Optional[Image]]
+
+_worker_blocks: List[SharedMemory] = []
+# noinspection PyProtectedMember
+_worker_bank: Optional[cv._TruthBank] = None
+
+
+def _attach(spec: _ArraySpec) -> Tuple[SharedMemory, Image]:
+    name, shape, dtype = spec
+    block = SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+# noinspection PyProtectedMember
+def _init_worker(specs: List[_ArraySpec]) -> None:
+    global _worker_bank
+    arrays = []
+    for spec in specs:
+        block, array = _attach(spec)
+        _worker_blocks.append(block)  # keep the mapping alive for the lifetime of the worker
+        arrays.append(array)
+    _worker_bank = cv._TruthBank(*arrays)
+
+
+# noinspection PyProtectedMember
+def _match_partition(task: _ScoreTask) -> Tuple[Image, Image]:
+    edges, bboxes, mapper_params, rows, subset = task
+    bbox_norm = [cv.BoundingBox.of(*bbox) for bbox in bboxes]
+    img_data: ImageComparisonData = edges, bbox_norm, cv._affine_mapper(*mapper_params)
+    return cv._match_truth_bank(img_data, _worker_bank, rows=rows, subset=subset)
+
+
+class ScoringPool:
+    # process pool scoring backend (see `identify_card.BankScorer`) -- the truth bank lives in shared memory and each
+    # request is split into one (interleaved) partition of the test bboxes per worker, so that every test patch is
+    # sampled by one worker only (sampling is over half the cost of a request). Workers return their bboxes' best
+    # matches & the scores are summed up here, in test bbox order (same scores as in-process). Workers stay alive
+    # (warm) until `close()`, which must be called to free the shared memory.
+    # EXPERIMENTAL, opt-in only: `benchmark.py <frames> -j` has shown it slower than in-process scoring in every
+    # configuration measured so far (0.22-0.52x against 52 truth images, 0.75-0.91x against 416 -- back when requests
+    # were split by truth image & every worker resampled the whole test image). Splitting by test bbox removed that
+    # duplicated work, but no multi-core machine has been measured since. Keep it off until a Pi records a speedup
+    workers: int
+    size: int  # number of truth images
+    _blocks: List[SharedMemory]
+
+    # noinspection PyProtectedMember
+    def __init__(self, *, workers: int):
+        bank = cv._GROUND_TRUTH_BANK
+        assert bank is not None, "Ground truth must be populated before starting a ScoringPool"
+        self.workers = workers
+        self.size = bank.size
+        self._blocks = []
+
+        specs = [self._share(array) for array in (bank.offsets, bank.records, bank.patches, bank.coarse_patches)]
+
+        self._pool = get_context("spawn").Pool(processes=workers, initializer=_init_worker, initargs=(specs,))
+
+    def _share(self, array: Image) -> _ArraySpec:
+        array = np.ascontiguousarray(array)
+        block = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        self._blocks.append(block)
+        return block.name, array.shape, array.dtype
+
+    def __call__(self, img_data: ImageComparisonData, subset: Optional[Image]) -> Image:
+        edges, bbox_norm, mapper = img_data
+        subset = None if subset is None else np.asarray(subset)
+        # noinspection PyProtectedMember
+        mapper_params = cv._affine_mapper_params(mapper)
+        bboxes = [tuple(bbox) for bbox in bbox_norm]
+        rows = np.arange(len(bboxes))
+        parts = [part for part in (rows[w::self.workers] for w in range(self.workers)) if len(part) > 0]
+
+        best = np.zeros((len(bboxes), self.size), dtype=np.float64)
+        found = np.zeros((len(bboxes), self.size), dtype=bool)
+        results = self._pool.map(_match_partition, [(edges, bboxes, mapper_params, part, subset) for part in parts])
+        for part, (part_best, part_found) in zip(parts, results):
+            best[part], found[part] = part_best, part_found
+        # noinspection PyProtectedMember
+        return cv._sum_matches(img_data, best, found, subset=subset)
+
+    def close(self) -> None:
+        self._pool.terminate()
+        self._pool.join()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks.clear()
+
+    def __enter__(self) -> ScoringPool:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
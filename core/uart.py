@@ -1,7 +1,13 @@
+from __future__ import annotations
+
 from enum import Enum
-from typing import Tuple, Union, Optional
+from queue import Queue, Empty
+from threading import Thread, Lock
+from time import monotonic_ns
+from typing import Tuple, List, Dict, Union, Optional, Callable, Final
+import asyncio
+import numpy as np
 import serial
-from time import sleep
 
 
 class RxActions(Enum):
@@ -10,6 +16,9 @@ class RxActions(Enum):
     START_SHUFFLE_SBC = "ACK to shuffle with RasPi/web-server's configurations"
     CAPTURE_IMAGE = "ACK of previous card slot && permission to scan next card (w/ count sync data)"
     RX_STRING = "Running string-builder data (single char transferred)"
+    NEGOTIATE = "ACK of the framed protocol @ the given baud rate index (legacy packet only)"
+    RX_CONFIG = "Whole `<field>:<value>` config string (framed only)"
+    PING = "Echo of the SBC's PING -- confirms the framed protocol (framed only)"
 
 
 class TxActions(Enum):
@@ -18,9 +27,46 @@ class TxActions(Enum):
     START_SHUFFLE_SBC = "(Outgoing) Request to start shuffle with RasPi/web-server's configurations"
     IDENTIFY_SLOT = "Location of slot to store card into (PI -> Micro)"
     REINDEX_SLOT = "Error correction and/or desync correction (see RxActions.CAPTURE_IMAGE)"
+    NEGOTIATE = "Offer of the framed protocol @ the given baud rate index (legacy packet only)"
+    IDENTIFY_SLOTS = "Batch of (card index, slot) assignments, i.e. corrections (framed only)"
+    PING = "Confirms the framed protocol after the baud rate switch (framed only)"
 
 
 RxPacket = Tuple[RxActions, Union[str, int, None]]
+TxArg = Union[int, List[Tuple[int, int]], None]
+
+# framed protocol -- negotiated after the RESET handshake (see `AsyncUART.negotiate`), every packet is a frame of
+#   SYNC | LEN | TYPE | PAYLOAD (LEN - 1 bytes) | CRC-16/CCITT of LEN..PAYLOAD (big endian)
+# with big endian 16-bit indices/slots. Config strings arrive whole, and slot assignments can be batched
+BAUD_RATES: Final[Tuple[int, ...]] = 9600, 57600, 115200, 230400  # NEGOTIATE arg = index into this
+_FRAME_SYNC: Final[int] = 0xa5
+_TX_FRAME_TYPES: Final[Dict[TxActions, int]] = {
+    TxActions.RESET: 0x00,
+    TxActions.START_SHUFFLE_MCU: 0x02,
+    TxActions.START_SHUFFLE_SBC: 0x03,
+    TxActions.IDENTIFY_SLOT: 0x20,
+    TxActions.IDENTIFY_SLOTS: 0x21,
+    TxActions.REINDEX_SLOT: 0x22,
+    TxActions.PING: 0x30,
+}
+_TX_FRAME_ACTIONS: Final[Dict[int, TxActions]] = {value: action for action, value in _TX_FRAME_TYPES.items()}
+_RX_FRAME_TYPES: Final[Dict[int, RxActions]] = {
+    0x00: RxActions.RESET,
+    0x02: RxActions.START_SHUFFLE_MCU,
+    0x03: RxActions.START_SHUFFLE_SBC,
+    0x10: RxActions.CAPTURE_IMAGE,
+    0x11: RxActions.RX_CONFIG,
+    0x30: RxActions.PING,
+}
+_MAX_SLOTS_PER_FRAME: Final[int] = 63  # (index, slot) pairs that fit into one IDENTIFY_SLOTS frame
+# (min, max) payload length of every frame type, per direction -- lets `FrameDecoder` reject a stray SYNC right away
+_TX_FRAME_PAYLOADS: Final[Dict[int, Tuple[int, int]]] = {
+    0x00: (0, 0), 0x02: (0, 0), 0x03: (0, 0), 0x20: (2, 2), 0x21: (4, 4 * _MAX_SLOTS_PER_FRAME), 0x22: (2, 2),
+    0x30: (0, 0),
+}
+_RX_FRAME_PAYLOADS: Final[Dict[int, Tuple[int, int]]] = {
+    0x00: (0, 0), 0x02: (0, 0), 0x03: (0, 0), 0x10: (2, 2), 0x11: (1, 0xfe), 0x30: (0, 0),
+}
 
 
 def _translate_packet(packet: int) -> RxPacket:
@@ -31,6 +77,8 @@ def _translate_packet(packet: int) -> RxPacket:
         return RxActions.RX_STRING, chr(packet & 0x7f)
     elif bits[6]:
         return RxActions.CAPTURE_IMAGE, packet & 0x3f
+    elif packet & 0x3c == 0x04:
+        return RxActions.NEGOTIATE, packet & 0x03
     else:
         assert packet & 0x3c == 0, "Invalid packet received: 0x%02x" % packet
         if bits[1]:
@@ -40,7 +88,7 @@ def _translate_packet(packet: int) -> RxPacket:
             return RxActions.RESET, None
 
 
-def _build_packet(action: TxActions, arg: Optional[int] = None) -> int:
+def _build_packet(action: TxActions, arg: TxArg = None) -> int:
     if action == TxActions.RESET:
         return 0x00
     if action == TxActions.START_SHUFFLE_MCU:
@@ -53,45 +101,403 @@ def _build_packet(action: TxActions, arg: Optional[int] = None) -> int:
     if action == TxActions.REINDEX_SLOT:
         assert arg is not None and 0 <= arg < 52, f"Invalid arg {arg} for action TxActions.REINDEX_SLOT"
         return 0xc0 | arg
+    if action == TxActions.NEGOTIATE:
+        assert arg is not None and 0 <= arg < len(BAUD_RATES), f"Invalid arg {arg} for action TxActions.NEGOTIATE"
+        return 0x04 | arg
     assert False, f"Unrecognized TxAction: {action} = {action.value}"
 
 
+def _crc16(data: bytes) -> int:
+    # CRC-16/CCITT-FALSE (poly 0x1021, init 0xffff)
+    crc = 0xffff
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) & 0xffff if crc & 0x8000 else (crc << 1) & 0xffff
+    return crc
+
+
+def encode_frame(frame_type: int, payload: bytes = b"") -> bytes:
+    body = bytes([len(payload) + 1, frame_type]) + payload
+    assert len(payload) + 1 <= 0xff, f"Frame payload too long ({len(payload)} bytes)"
+    return bytes([_FRAME_SYNC]) + body + _crc16(body).to_bytes(2, 'big')
+
+
+class FrameDecoder:
+    # incremental frame parser for one direction (`payloads` = _TX_FRAME_PAYLOADS or _RX_FRAME_PAYLOADS) -- a SYNC
+    # followed by an unknown type, a LEN out of that type's bounds or a bad CRC is dropped (& counted), and parsing
+    # resumes at the next SYNC. A stray SYNC with a plausible LEN still holds back the frames behind it, until
+    # `expire` is called after an inter-byte timeout
+    errors: int
+
+    def __init__(self, payloads: Dict[int, Tuple[int, int]]):
+        self._payloads = payloads
+        self._buf = bytearray()
+        self.errors = 0
+
+    def feed(self, data: bytes) -> List[Tuple[int, bytes]]:
+        # returns every complete (frame type, payload) in the data received so far
+        self._buf += data
+        frames = []
+        while True:
+            start = self._buf.find(_FRAME_SYNC)
+            if start < 0:
+                self._buf.clear()
+                break
+            del self._buf[:start]
+            if len(self._buf) < 3:
+                break
+            length, frame_type = self._buf[1], self._buf[2]
+            bounds = self._payloads.get(frame_type)
+            if bounds is None or not bounds[0] <= length - 1 <= bounds[1]:
+                self.errors += 1
+                del self._buf[:1]
+                continue
+            end = 2 + length + 2
+            if len(self._buf) < end:
+                break
+            body = bytes(self._buf[1:2 + length])
+            if _crc16(body) != int.from_bytes(self._buf[2 + length:end], 'big'):
+                self.errors += 1
+                del self._buf[:1]
+                continue
+            frames.append((body[1], body[2:]))
+            del self._buf[:end]
+        return frames
+
+    def expire(self) -> List[Tuple[int, bytes]]:
+        # the line went idle with a partial frame buffered -- frames are sent in one burst, so its SYNC was a stray
+        # byte: resyncs at the next SYNC & returns the frames found behind it
+        if len(self._buf) == 0:
+            return []
+        self.errors += 1
+        del self._buf[:1]
+        return self.feed(b"")
+
+
+def _u16(value: int) -> bytes:
+    assert value is not None and 0 <= value <= 0xffff, f"Invalid 16-bit arg {value}"
+    return value.to_bytes(2, 'big')
+
+
+def _build_frame(action: TxActions, arg: TxArg = None) -> bytes:
+    assert action in _TX_FRAME_TYPES, f"TxAction {action} has no frame"
+    frame_type = _TX_FRAME_TYPES[action]
+    if action in (TxActions.IDENTIFY_SLOT, TxActions.REINDEX_SLOT):
+        return encode_frame(frame_type, _u16(arg))
+    if action == TxActions.IDENTIFY_SLOTS:
+        return encode_frame(frame_type, b"".join(_u16(index) + _u16(slot) for index, slot in arg))
+    return encode_frame(frame_type)
+
+
+def _translate_frame(frame_type: int, payload: bytes) -> RxPacket:
+    assert frame_type in _RX_FRAME_TYPES, "Invalid frame type received: 0x%02x" % frame_type
+    action = _RX_FRAME_TYPES[frame_type]
+    if action == RxActions.CAPTURE_IMAGE:
+        assert len(payload) == 2, f"Invalid CAPTURE_IMAGE payload {payload}"
+        return action, int.from_bytes(payload, 'big')
+    if action == RxActions.RX_CONFIG:
+        assert payload.isascii(), f"Invalid RX_CONFIG payload {payload}"
+        return action, payload.decode('ascii')
+    assert len(payload) == 0, f"Invalid {action.name} payload {payload}"
+    return action, None
+
+
+def _translate_tx_packet(packet: int) -> Tuple[TxActions, TxArg]:
+    # inverse of `_build_packet`, i.e. the SBC's packets as seen by the MCU (see `mcu_emulator`, `uart_trace`)
+    if packet & 0xc0 == 0xc0:
+        return TxActions.REINDEX_SLOT, packet & 0x3f
+    if packet & 0x80:
+        return TxActions.IDENTIFY_SLOT, packet & 0x3f
+    if packet & 0xfc == 0x04:
+        return TxActions.NEGOTIATE, packet & 0x03
+    assert packet in (0x00, 0x02, 0x03), "Invalid packet sent by the SBC: 0x%02x" % packet
+    return {0x00: TxActions.RESET, 0x02: TxActions.START_SHUFFLE_MCU, 0x03: TxActions.START_SHUFFLE_SBC}[packet], None
+
+
+def _translate_tx_frame(frame_type: int, payload: bytes) -> Tuple[TxActions, TxArg]:
+    # inverse of `_build_frame`
+    assert frame_type in _TX_FRAME_ACTIONS, "Invalid frame type sent by the SBC: 0x%02x" % frame_type
+    action = _TX_FRAME_ACTIONS[frame_type]
+    if action in (TxActions.IDENTIFY_SLOT, TxActions.REINDEX_SLOT):
+        return action, int.from_bytes(payload, 'big')
+    if action == TxActions.IDENTIFY_SLOTS:
+        values = [int.from_bytes(payload[i:i + 2], 'big') for i in range(0, len(payload), 2)]
+        return action, list(zip(values[::2], values[1::2]))
+    return action, None
+
+
+# binary traffic trace (see `TraceRecorder`) -- one record per byte on the line. `TRACE_PROTOCOL` records mark a
+# protocol switch (byte = 1 for framed, 0 for legacy) so that the trace can be decoded offline (see `uart_trace`)
+TRACE_DTYPE: Final[np.dtype] = np.dtype([('t_ns', '<i8'), ('dir', 'u1'), ('byte', 'u1')])
+TRACE_TX: Final[int] = 0
+TRACE_RX: Final[int] = 1
+TRACE_PROTOCOL: Final[int] = 2
+_TRACE_CAPACITY: Final[int] = 1 << 16  # records buffered before a write to disk (640 KB, i.e. hundreds of decks)
+
+
+class TraceRecorder:
+    # records every TX/RX byte with its `monotonic_ns` timestamp into a preallocated numpy ring, which is appended to
+    # `path` whenever it fills up (& on `flush`/`close`) -- no formatting or I/O per packet, so it can stay enabled in
+    # production. Bytes read/written in one call share a timestamp (taken right after the read, right before the write)
+    path: str
+
+    def __init__(self, path: str, *, capacity: int = _TRACE_CAPACITY):
+        self.path = path
+        self._ring = np.zeros(capacity, dtype=TRACE_DTYPE)
+        self._size = 0
+        self._lock = Lock()  # TX happens on the event loop, RX on the reader thread
+        self._file = open(path, 'wb')
+
+    def record(self, direction: int, data: bytes) -> None:
+        t_ns = monotonic_ns()
+        values = np.frombuffer(data, dtype=np.uint8)
+        with self._lock:
+            start = 0
+            while start < len(values):
+                if self._size == len(self._ring):
+                    self._write()
+                n = min(len(values) - start, len(self._ring) - self._size)
+                records = self._ring[self._size:self._size + n]
+                records['t_ns'] = t_ns
+                records['dir'] = direction
+                records['byte'] = values[start:start + n]
+                self._size += n
+                start += n
+
+    def _write(self) -> None:
+        self._ring[:self._size].tofile(self._file)
+        self._file.flush()
+        self._size = 0
+
+    def flush(self) -> None:
+        with self._lock:
+            self._write()
+
+    def close(self) -> None:
+        with self._lock:
+            self._write()
+            self._file.close()
+
+
+def load_trace(path: str) -> np.ndarray:
+    # every record of a `TraceRecorder` file, as a TRACE_DTYPE array
+    return np.fromfile(path, dtype=TRACE_DTYPE)
+
+
+_READ_TIMEOUT: float = 0.1  # seconds -- bounds how long the reader thread takes to notice `close()`
+_NEGOTIATE_TIMEOUT_MS: Final[int] = 100
+_BAUD_SWITCH_DELAY: Final[float] = 0.01  # seconds -- lets the MCU switch its baud rate before the confirmation PING
+
+
 class UART:
+    # a dedicated reader thread blocks in `serial.read` and decodes incoming bytes (in bulk) into a packet queue --
+    # `rx`/`rx_blocking`/`rx_timeout` are queue operations, so wake-up latency is bounded by the serial driver.
+    # Starts in the legacy one-byte protocol @ `baud_rate`, see `set_protocol` for the framed one
     verbose: bool = False
+    baud_rate: int  # of the legacy protocol
+    framed: bool
+    trace: Optional[TraceRecorder]
+
+    def __init__(self, *, baud_rate: int, port: str = "/dev/ttyS0", trace: Optional[str] = None):
+        # `trace` is the path of an (optional) binary traffic trace, see `TraceRecorder`
+        if UART.verbose:
+            print(f"UART enabled on {port} @ baud={baud_rate}")
+        self.baud_rate = baud_rate
+        self.framed = False
+        self.trace = TraceRecorder(trace) if trace is not None else None
+        self._decoder = FrameDecoder(_RX_FRAME_PAYLOADS)
+        self.ser = serial.Serial(port, baud_rate, timeout=_READ_TIMEOUT)
+        # decoded packets, or the exception raised decoding an invalid packet (re-raised by the consumer)
+        self._packets: Queue[Union[RxPacket, Exception]] = Queue()
+        self._deliver: Callable[[Union[RxPacket, Exception]], None] = self._packets.put
+        self._deliver_lock = Lock()
+        self._running = True
+        self._reader = Thread(target=self._read_loop, name="uart-reader", daemon=True)
+        self._reader.start()
 
-    def __init__(self, *, baud_rate: int):
+    def set_protocol(self, *, framed: bool, baud_rate: Optional[int] = None) -> None:
+        # switches between the legacy & framed protocols -- `baud_rate` defaults to the legacy one
+        baud_rate = self.baud_rate if baud_rate is None else baud_rate
         if UART.verbose:
-            print(f"UART enabled @ baud={baud_rate}")
-        self.ser = serial.Serial("/dev/ttyS0", baud_rate)
+            print(f"UART switching to {'framed' if framed else 'legacy'} protocol @ baud={baud_rate}")
+        self.ser.flush()
+        self.ser.baudrate = baud_rate
+        self._decoder = FrameDecoder(_RX_FRAME_PAYLOADS)
+        self.framed = framed
+        if self.trace is not None:
+            self.trace.record(TRACE_PROTOCOL, bytes([framed]))
 
-    def tx(self, action: TxActions, arg: Optional[int] = None) -> None:
-        packet = _build_packet(action, arg).to_bytes(1, 'little')
+    def tx(self, action: TxActions, arg: TxArg = None) -> None:
+        if not self.framed:
+            packet = _build_packet(action, arg).to_bytes(1, 'little')
+        elif action == TxActions.IDENTIFY_SLOTS and len(arg) > _MAX_SLOTS_PER_FRAME:
+            for start in range(0, len(arg), _MAX_SLOTS_PER_FRAME):
+                self.tx(action, arg[start:start + _MAX_SLOTS_PER_FRAME])
+            return
+        else:
+            packet = _build_frame(action, arg)
         if UART.verbose:
             print(f"Sent packet(action={action.name}, arg={arg}) as packet(value={packet})")
+        if self.trace is not None:
+            self.trace.record(TRACE_TX, packet)
         self.ser.write(packet)
 
-    def _get_rx_packet(self) -> RxPacket:
-        # @precondition: self.ser.in_waiting > 0
-        assert self.ser.in_waiting > 0, "Cannot call UART._get_rx_packet() unless packet is actually available"
-        packet = self.ser.read(1)
-        action, arg = _translate_packet(packet)
-        if UART.verbose:
-            print(f"Received packet(value={packet}) as packet(action={action.name}, arg={arg})")
-        return action, arg
+    @staticmethod
+    def _translate_frames(frames: List[Tuple[int, bytes]]) -> List[Union[RxPacket, Exception]]:
+        packets: List[Union[RxPacket, Exception]] = []
+        for frame_type, payload in frames:
+            try:
+                packets.append(_translate_frame(frame_type, payload))
+            except (AssertionError, ValueError) as e:  # ValueError: i.e. UnicodeDecodeError
+                packets.append(e)
+        return packets
+
+    def _decode(self, data: bytes) -> List[Union[RxPacket, Exception]]:
+        if self.framed:
+            return self._translate_frames(self._decoder.feed(data))
+        packets: List[Union[RxPacket, Exception]] = []
+        for packet in data:
+            try:
+                packets.append(_translate_packet(packet))
+            except AssertionError as e:
+                packets.append(e)
+        return packets
+
+    def _read_loop(self) -> None:
+        while self._running:
+            # blocks until at least 1 byte arrives (or the timeout), then drains whatever else is already buffered
+            try:
+                data = self.ser.read(max(1, self.ser.in_waiting))
+            except (serial.SerialException, OSError) as e:  # e.g. the device disappeared -- re-raised by the consumer
+                with self._deliver_lock:
+                    self._deliver(e)
+                return
+            if len(data) > 0:
+                if self.trace is not None:
+                    self.trace.record(TRACE_RX, data)
+                packets = self._decode(data)
+                if UART.verbose:
+                    print(f"Received bytes {data} as packets {packets}")
+            elif self.framed:  # inter-byte timeout -- drops a partial frame left by a stray SYNC
+                packets = self._translate_frames(self._decoder.expire())
+            else:
+                continue
+            with self._deliver_lock:
+                for packet in packets:
+                    self._deliver(packet)
+
+    def attach(self, deliver: Callable[[Union[RxPacket, Exception]], None]) -> None:
+        # hands every further decoded packet to `deliver` (called on the reader thread) instead of the packet queue --
+        # packets already queued are handed over first. `rx`/`rx_blocking`/`rx_timeout` no longer receive anything
+        with self._deliver_lock:
+            while not self._packets.empty():
+                deliver(self._packets.get_nowait())
+            self._deliver = deliver
+
+    @staticmethod
+    def _unwrap(packet: Union[RxPacket, Exception]) -> RxPacket:
+        if isinstance(packet, Exception):
+            raise packet
+        return packet
 
     def rx(self) -> Optional[RxPacket]:
-        return self._get_rx_packet() if self.ser.in_waiting > 0 else None
+        try:
+            return self._unwrap(self._packets.get_nowait())
+        except Empty:
+            return None
 
-    def rx_blocking(self, ms_delay: Union[int, float] = 1) -> RxPacket:
-        while self.ser.in_waiting == 0:
-            sleep(ms_delay / 1000)
-        else:
-            # guaranteed: self.ser.in_waiting > 0
-            return self._get_rx_packet()
-
-    def rx_timeout(self, timeout_ms: int = 500) -> Optional[RxPacket]:
-        for _ in range(timeout_ms):
-            if self.ser.in_waiting > 0:
-                return self._get_rx_packet()
-            sleep(0.001)
-        return None
+    def rx_blocking(self) -> RxPacket:
+        return self._unwrap(self._packets.get())
+
+    def rx_timeout(self, timeout_ms: Union[int, float] = 500) -> Optional[RxPacket]:
+        try:
+            return self._unwrap(self._packets.get(timeout=timeout_ms / 1000))
+        except Empty:
+            return None
+
+    def close(self) -> None:
+        self._running = False
+        self._reader.join()
+        self.ser.close()
+        if self.trace is not None:
+            self.trace.close()
+
+
+class AsyncUART:
+    # asyncio adapter of UART -- the reader thread hands decoded packets straight to the event loop, so the rx methods
+    # are awaitable and never block the loop. Transmits are short (buffered) writes, so they stay synchronous
+    uart: UART
+
+    def __init__(self, uart: UART, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.uart = uart
+        self._loop = loop if loop is not None else asyncio.get_running_loop()
+        self._packets: asyncio.Queue[Union[RxPacket, Exception]] = asyncio.Queue()
+        uart.attach(lambda packet: self._loop.call_soon_threadsafe(self._packets.put_nowait, packet))
+
+    @property
+    def framed(self) -> bool:
+        return self.uart.framed
+
+    def tx(self, action: TxActions, arg: TxArg = None) -> None:
+        self.uart.tx(action, arg)
+
+    def reset_protocol(self) -> None:
+        # back to the legacy protocol -- the MCU falls back to it on every RESET
+        if self.uart.framed or self.uart.ser.baudrate != self.uart.baud_rate:
+            self.uart.set_protocol(framed=False)
+
+    async def negotiate(self, baud_rate: int) -> bool:
+        # offers the framed protocol @ `baud_rate` (must be in BAUD_RATES) right after the RESET handshake -- the MCU
+        # answers with the baud rate index it accepts (or not at all, if it only speaks the legacy protocol), and the
+        # switch is confirmed with a PING echo. On any failure both sides stay on/return to the legacy protocol
+        self.uart.tx(TxActions.NEGOTIATE, BAUD_RATES.index(baud_rate))
+        response = await self._expect(RxActions.NEGOTIATE)
+        if response is None:
+            return False
+        await asyncio.sleep(_BAUD_SWITCH_DELAY)
+        self.uart.set_protocol(framed=True, baud_rate=BAUD_RATES[response[1]])
+        self.uart.tx(TxActions.PING)
+        if await self._expect(RxActions.PING) is None:
+            self.uart.set_protocol(framed=False)
+            return False
+        return True
+
+    async def _expect(self, action: RxActions) -> Optional[RxPacket]:
+        # waits (up to the negotiation timeout) for an `action` packet -- any other packet received meanwhile is put
+        # back in front of the queue, so that e.g. a legacy MCU's config string is not lost
+        deadline = self._loop.time() + _NEGOTIATE_TIMEOUT_MS / 1000
+        others: List[Union[RxPacket, Exception]] = []
+        response: Optional[RxPacket] = None
+        while (remaining := deadline - self._loop.time()) > 0:
+            try:
+                packet = await asyncio.wait_for(self._packets.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not isinstance(packet, Exception) and packet[0] == action:
+                response = packet
+                break
+            others.append(packet)
+        while not self._packets.empty():
+            others.append(self._packets.get_nowait())
+        for packet in others:
+            self._packets.put_nowait(packet)
+        return response
+
+    # noinspection PyProtectedMember
+    def rx(self) -> Optional[RxPacket]:
+        try:
+            return UART._unwrap(self._packets.get_nowait())
+        except asyncio.QueueEmpty:
+            return None
+
+    # noinspection PyProtectedMember
+    async def rx_blocking(self) -> RxPacket:
+        return UART._unwrap(await self._packets.get())
+
+    # noinspection PyProtectedMember
+    async def rx_timeout(self, timeout_ms: Union[int, float] = 500) -> Optional[RxPacket]:
+        try:
+            return UART._unwrap(await asyncio.wait_for(self._packets.get(), timeout_ms / 1000))
+        except asyncio.TimeoutError:
+            return None
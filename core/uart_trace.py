@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+from typing import List, Tuple, Dict, Union, Optional, Final
+import numpy as np
+
+# noinspection PyProtectedMember
+from uart import RxActions, TxActions, FrameDecoder, TRACE_TX, TRACE_RX, TRACE_PROTOCOL, load_trace, \
+    _TX_FRAME_PAYLOADS, _RX_FRAME_PAYLOADS, _translate_packet, _translate_frame, _translate_tx_packet, \
+    _translate_tx_frame
+
+# (timestamp ns, TRACE_TX/TRACE_RX, action, arg) -- action is None for bytes that do not decode into a valid packet
+TraceEvent = Tuple[int, int, Union[RxActions, TxActions, None], object]
+
+# deck phases reported by `DeckTiming.phases`, in order
+PHASES: Tuple[str, ...] = ("handshake", "settings", "recognition", "mechanical", "resync", "corrections", "idle")
+
+
+def decode_trace(records: np.ndarray) -> List[TraceEvent]:
+    # rebuilds the packets of both directions from a `uart.TraceRecorder` trace, following its protocol switches
+    records = records[np.argsort(records['t_ns'], kind='stable')]
+    events: List[TraceEvent] = []
+    framed = False
+    decoders = {TRACE_TX: FrameDecoder(_TX_FRAME_PAYLOADS), TRACE_RX: FrameDecoder(_RX_FRAME_PAYLOADS)}
+    translate = {TRACE_TX: (_translate_tx_packet, _translate_tx_frame), TRACE_RX: (_translate_packet, _translate_frame)}
+    for t_ns, direction, byte in zip(records['t_ns'].tolist(), records['dir'].tolist(), records['byte'].tolist()):
+        if direction == TRACE_PROTOCOL:
+            framed = byte == 1
+            decoders = {TRACE_TX: FrameDecoder(_TX_FRAME_PAYLOADS), TRACE_RX: FrameDecoder(_RX_FRAME_PAYLOADS)}
+            continue
+        translate_packet, translate_frame = translate[direction]
+        try:
+            if framed:  # a frame is timestamped by the read/write of its last byte
+                for frame in decoders[direction].feed(bytes([byte])):
+                    events.append((t_ns, direction, *translate_frame(*frame)))
+            else:
+                events.append((t_ns, direction, *translate_packet(byte)))
+        except (AssertionError, ValueError):
+            events.append((t_ns, direction, None, byte))
+    return events
+
+
+class CardTiming:
+    index: int  # as sent by the MCU with CAPTURE_IMAGE
+    capture_ns: int  # CAPTURE_IMAGE received
+    identify_ns: int  # IDENTIFY_SLOT sent
+    mechanical_ns: Optional[int]  # IDENTIFY_SLOT sent -> the MCU's next CAPTURE_IMAGE received
+
+    def __init__(self, index: int, capture_ns: int, identify_ns: int):
+        self.index = index
+        self.capture_ns = capture_ns
+        self.identify_ns = identify_ns
+        self.mechanical_ns = None
+
+    @property
+    def round_trip_ns(self) -> int:
+        return self.identify_ns - self.capture_ns
+
+
+class DeckTiming:
+    # one deck, from the SBC's first handshake RESET to the next deck's (or the end of the trace)
+    begin_ns: int
+    answered_ns: Optional[int]  # MCU's RESET answer received
+    handshake_ns: Optional[int]  # end of the handshake (incl. the SBC's drain & the protocol negotiation)
+    start_ns: Optional[int]  # START_SHUFFLE_MCU ack sent / START_SHUFFLE_SBC received
+    cards_ns: Optional[int]  # IDENTIFY_SLOT of the last card sent
+    last_ns: int  # last packet of this deck
+    end_ns: int
+    cards: List[CardTiming]
+    desyncs: int  # CAPTURE_IMAGE answered with REINDEX_SLOT
+    corrections: int
+    errors: int  # undecodable bytes/packets
+    aborted: bool  # RESET by the MCU after the start
+
+    def __init__(self, begin_ns: int):
+        self.begin_ns = self.last_ns = self.end_ns = begin_ns
+        self.answered_ns = self.handshake_ns = self.start_ns = self.cards_ns = None
+        self.cards = []
+        self.desyncs = self.corrections = self.errors = 0
+        self.aborted = False
+
+    def phases(self) -> Dict[str, float]:
+        # wall time (seconds) of every phase in PHASES -- they add up to the deck's total. The card phase is split
+        # into the SBC's round trips (recognition), the MCU's card handling (mechanical) & everything else (resync,
+        # e.g. REINDEX_SLOT exchanges, the wait for the first CAPTURE_IMAGE). Phases never reached take 0
+        handshake = self.handshake_ns if self.handshake_ns is not None else self.last_ns
+        start = self.start_ns if self.start_ns is not None else max(handshake, self.last_ns)
+        cards = self.cards_ns if self.cards_ns is not None else max(start, self.last_ns)
+        recognition = sum(card.round_trip_ns for card in self.cards)
+        mechanical = sum(card.mechanical_ns for card in self.cards if card.mechanical_ns is not None)
+        ns = {
+            "handshake": handshake - self.begin_ns,
+            "settings": start - handshake,
+            "recognition": recognition,
+            "mechanical": mechanical,
+            "resync": cards - start - recognition - mechanical,
+            "corrections": self.last_ns - cards,
+            "idle": self.end_ns - self.last_ns,
+        }
+        return {phase: value / 1e9 for phase, value in ns.items()}
+
+
+_NEGOTIATION: Final[Tuple[Union[RxActions, TxActions], ...]] = \
+    (TxActions.NEGOTIATE, RxActions.NEGOTIATE, TxActions.PING, RxActions.PING)
+
+
+def analyze(events: List[TraceEvent]) -> List[DeckTiming]:
+    # splits the decoded trace into decks & matches every CAPTURE_IMAGE with the SBC's answer -- decks whose RESET was
+    # never answered, and a last deck cut off by the end of the trace before its start (i.e. the RESET at shutdown),
+    # are left out
+    decks: List[DeckTiming] = []
+    deck: Optional[DeckTiming] = None
+    capture: Optional[Tuple[int, int]] = None  # (t_ns, index) of the unanswered CAPTURE_IMAGE
+    settings = False  # past the handshake of the current deck
+    for t_ns, direction, action, arg in events:
+        if direction == TRACE_TX and action == TxActions.RESET:
+            if deck is None or deck.answered_ns is not None:  # otherwise a handshake retry
+                if deck is not None:
+                    deck.end_ns = t_ns
+                deck = DeckTiming(t_ns)
+                decks.append(deck)
+                capture = None
+                settings = False
+            deck.last_ns = t_ns
+            continue
+        if deck is None:  # trace started mid-deck
+            continue
+        deck.last_ns = deck.end_ns = t_ns
+        if action is None:
+            deck.errors += 1
+        elif direction == TRACE_RX and action == RxActions.RESET:
+            if deck.answered_ns is None:
+                deck.answered_ns = t_ns
+            elif deck.start_ns is not None:
+                deck.aborted = True
+        elif deck.answered_ns is None:
+            continue
+        elif deck.start_ns is None:
+            # the handshake lasts until the negotiation's last packet, or else the first config/start packet (the
+            # SBC's drain of the MCU's RESET answers is silent)
+            if action in _NEGOTIATION and not settings:
+                deck.handshake_ns = t_ns
+                continue
+            if not settings:
+                settings = True
+                deck.handshake_ns = t_ns if deck.handshake_ns is None else deck.handshake_ns
+            if action in (TxActions.START_SHUFFLE_MCU, RxActions.START_SHUFFLE_SBC):
+                deck.start_ns = t_ns
+        elif deck.cards_ns is None:
+            if action == RxActions.CAPTURE_IMAGE:
+                if len(deck.cards) > 0 and deck.cards[-1].mechanical_ns is None:
+                    deck.cards[-1].mechanical_ns = t_ns - deck.cards[-1].identify_ns
+                capture = t_ns, arg
+            elif action == TxActions.REINDEX_SLOT and capture is not None:
+                deck.desyncs += 1
+                capture = None
+            elif action == TxActions.IDENTIFY_SLOT and capture is not None:
+                deck.cards.append(CardTiming(capture[1], capture[0], t_ns))
+                if capture[1] == 51:
+                    deck.cards_ns = t_ns
+                capture = None
+        elif action == TxActions.IDENTIFY_SLOTS:
+            deck.corrections += len(arg)
+        elif action == TxActions.REINDEX_SLOT:  # legacy corrections are (REINDEX_SLOT, IDENTIFY_SLOT) pairs
+            deck.corrections += 1
+    if len(decks) > 0 and decks[-1].start_ns is None:
+        decks.pop()
+    return [deck for deck in decks if deck.answered_ns is not None]
+
+
+def _ms_stats(values_ns: List[int]) -> str:
+    if len(values_ns) == 0:
+        return "n/a"
+    ms = np.array(values_ns) / 1e6
+    return (f"mean {ms.mean():.2f} | p50 {np.percentile(ms, 50):.2f} | p95 {np.percentile(ms, 95):.2f} | "
+            f"max {ms.max():.2f} ms")
+
+
+if __name__ == '__main__':
+    import sys
+
+    if not len(sys.argv) > 1 or 'help' in sys.argv[1]:
+        print("Usage: <script> <arg1=trace file> [-c]")
+        print("Suggested usage: <script> ./uart.trace")
+        print("  reports per deck where the wall time went, and the card round trip/mechanical time distributions")
+        print("  -c also lists every card's timings")
+    else:
+        _events = decode_trace(load_trace(sys.argv[1]))
+        _decks = analyze(_events)
+        print(f"{len(_events)} packets, {len(_decks)} deck(s)")
+        for _i, _deck in enumerate(_decks):
+            _phases = _deck.phases()
+            _total = (_deck.end_ns - _deck.begin_ns) / 1e9
+            print(f"deck {_i}: {len(_deck.cards)} cards in {_total:.3f} s{' (aborted)' if _deck.aborted else ''} -- "
+                  f"{_deck.desyncs} desyncs, {_deck.corrections} corrections, {_deck.errors} errors")
+            print("  " + " | ".join(f"{phase} {seconds * 1000:.0f} ms ({seconds / max(_total, 1e-9):.0%})"
+                                    for phase, seconds in _phases.items()))
+            if '-c' in sys.argv:
+                for _card in _deck.cards:
+                    _mechanical = f"{_card.mechanical_ns / 1e6:.2f} ms" if _card.mechanical_ns is not None else "-"
+                    print(f"  card {_card.index:2d}: round trip {_card.round_trip_ns / 1e6:.2f} ms, "
+                          f"mechanical {_mechanical}")
+        _cards = [card for deck in _decks for card in deck.cards]
+        print(f"round trip: {_ms_stats([card.round_trip_ns for card in _cards])}")
+        print(f"mechanical: {_ms_stats([card.mechanical_ns for card in _cards if card.mechanical_ns is not None])}")
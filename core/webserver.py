@@ -9,12 +9,22 @@ with open("form.html", 'r') as _f:
 
 class _HTTPHandler(BaseHTTPRequestHandler):
     config_handler: Optional[Callable[[List[str]], None]] = None
+    metrics_handler: Optional[Callable[[], str]] = None
 
     def write_body(self, line: str) -> None:
         self.wfile.write(bytes(line, "utf-8"))
 
     def do_GET(self):
-        if '?' not in self.path:
+        if self.path.split('?')[0] == "/metrics":
+            if _HTTPHandler.metrics_handler is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-type", "text/plain; version=0.0.4")
+            self.end_headers()
+            self.write_body(_HTTPHandler.metrics_handler())
+        elif '?' not in self.path:
             self.send_response(200)
             self.send_header("Content-type", "text/html")
             self.end_headers()
@@ -50,8 +60,10 @@ class _HTTPHandler(BaseHTTPRequestHandler):
                 _HTTPHandler.config_handler(config_list)
 
 
-def start_webserver(config_handler: Callable[[List[str]], None], *, verbose: bool = False) -> None:
+def start_webserver(config_handler: Callable[[List[str]], None], *,
+                    metrics_handler: Optional[Callable[[], str]] = None, verbose: bool = False) -> None:
     _HTTPHandler.config_handler = config_handler
+    _HTTPHandler.metrics_handler = metrics_handler
     if verbose:
         print(f"Starting webserver running @ http://{_IP}:{_PORT}")
     HTTPServer((_IP, _PORT), _HTTPHandler).serve_forever()